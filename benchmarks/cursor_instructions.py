@@ -0,0 +1,57 @@
+"""
+模擬拖曳滑鼠，量測游標每秒產生多少個新的 graphics instruction
+
+    python benchmarks/cursor_instructions.py --events 20000 --events-per-frame 8
+
+每 events-per-frame 個 mouse_pos 事件呼叫一次 Clock.tick() 模擬一個 frame
+"""
+
+import argparse
+from time import perf_counter
+
+from kivy.clock import Clock
+from kivy.core.window import Window
+
+from kivyguidescreen import GuideScreenManager, GuideScreen
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--events-per-frame', type=int, default=8)
+    parser.add_argument('--cursor', default='big cross', choices=['big cross', 'tiny cross'])
+    args = parser.parse_args()
+
+    gsm = GuideScreenManager(guidescreens=[GuideScreen(name='drag', cursor=args.cursor)])
+    Clock.tick()
+
+    seen = set()
+    allocations = 0
+
+    def count_new_instructions():
+        nonlocal allocations
+        for ins in gsm.cursor_instruction.children:
+            if id(ins) not in seen:
+                seen.add(id(ins))
+                allocations += 1
+
+    count_new_instructions()
+    allocations = 0
+
+    start = perf_counter()
+    for i in range(args.events):
+        Window.mouse_pos = (100 + i % 500, 100 + (i * 7) % 300)
+        count_new_instructions()
+        if i % args.events_per_frame == args.events_per_frame - 1:
+            Clock.tick()
+            count_new_instructions()
+    elapsed = perf_counter() - start
+
+    print('mouse events            {:d}'.format(args.events))
+    print('events per second       {:.0f}'.format(args.events / elapsed))
+    print('new instructions        {:d}'.format(allocations))
+    print('instructions per second {:.0f}'.format(allocations / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+"""
+在本機模擬 datahub 的 socketio server，讓相機與 aruco 的畫面不接硬體也能跑起來量測
+
+    python benchmarks/fakedatahub.py --port 8080 --width 1920 --height 1080 --fps 30 --latency 0.005
+
+支援的事件
+    datahub.<節點>          回傳 dict(image=<sio image>, timestamp, seq, 以及 aruco 相關欄位)
+                            節點名稱含 depth 時給 uint16 影像，含 gray 時給單通道影像
+                            data 可以是 siotypes.image_request 產生的 encoding / scale / roi / colorfmts
+                            彩色影像與 opencv 相同是 bgr，colorfmts 中沒有 bgr 時轉成 rgb 再送出
+    datahub.batch           依 dict(paths, ...) 一次回傳 dict(frames={<節點>: message})
+    set_config              記下 dict(path, config)，回傳 True
+    jsonhub.save            以 data['id'] 存下 dict，回傳 True
+    jsonhub.load            回傳 id 對應的 dict，沒有時回傳 None
+    jsonhub.batch_save      依 utils/jsonhub.py 的協定一次存多個 id，回傳每個 id 的新版本
+    subscribe / unsubscribe 依 dict(path, max_fps) 主動推送影像
+
+每個節點最多每秒產生 --fps 張新影像，比這更頻繁的請求拿到的是同一張
+--latency 是每個回應額外延遲的秒數，--drop-rate 是不回應的機率，用來模擬不穩定的 datahub
+"""
+
+import json
+import zlib
+import random
+import asyncio
+import argparse
+from time import time
+
+import numpy as np
+
+
+class SyntheticCamera:
+
+    # 一個節點的假影像: 固定的漸層底圖加上一個緩慢繞圈的白色方塊當作 aruco
+    # 彩色影像與 opencv 的相機相同是 bgr 順序
+
+    def __init__(self, name, width, height, fps):
+        self.name = name
+        self.fps = fps
+        self.seq = 0
+        self._frame_time = 0
+        self._message = None
+
+        if 'depth' in name:
+            self._base = np.repeat(np.linspace(500, 3500, height)[:, None], width, axis=1).astype(np.uint16)
+            self._marker_value = 1000
+        elif 'gray' in name:
+            self._base = np.repeat(np.linspace(0, 255, height)[:, None], width, axis=1).astype(np.uint8)
+            self._marker_value = 255
+        else:
+            y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+            x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+            self._base = np.stack(np.broadcast_arrays(x, y, 255 - (x + y) / 2), axis=-1).astype(np.uint8)
+            self._marker_value = 255
+
+    def frame(self):
+        # 回傳 (影像, aruco 資料)，頻率超過 fps 時沿用上一張
+        now = time()
+        if self._message is not None and now - self._frame_time < 1 / self.fps:
+            return self._message
+
+        h, w = self._base.shape[:2]
+        size = max(8, min(w, h) // 8)
+        angle = now * 0.5
+        cx = w / 2 + np.cos(angle) * w / 6
+        cy = h / 2 + np.sin(angle) * h / 6
+        x0, y0 = int(cx - size / 2), int(cy - size / 2)
+
+        img = self._base.copy()
+        img[y0:y0+size, x0:x0+size] = self._marker_value
+
+        corners = [[x0, y0], [x0 + size, y0], [x0 + size, y0 + size], [x0, y0 + size]]
+        aruco = dict(
+            aruco_id_found=[0],
+            corners={'0': corners},
+            contours=[corners],
+            pose_ue4={'0': dict(location=[cy, cx, 0], rotation=[0, 0, np.rad2deg(angle) % 360])})
+
+        self.seq += 1
+        self._frame_time = now
+        self._message = (img, aruco, self.seq, now)
+        return self._message
+
+
+def encode_image(img, request):
+    # 依 request 裁切、縮小並編碼成 sio image
+    applied = {}
+
+    roi = request.get('roi')
+    if roi:
+        x, y, w, h = roi
+        img = img[y:y+h, x:x+w]
+        applied['roi'] = roi
+
+    scale = request.get('scale', 1)
+    if scale != 1:
+        step = max(1, round(1 / scale))
+        img = img[::step, ::step]
+        applied['scale'] = 1 / step
+
+    # client 無法直接顯示 bgr 時 (包含舊版 client) 轉成 rgb
+    colorfmt = None
+    if img.ndim == 3:
+        colorfmt = 'bgr' if img.shape[2] == 3 else 'bgra'
+        if colorfmt not in request.get('colorfmts', []):
+            img = img[..., [2, 1, 0, 3][:img.shape[2]]]
+            colorfmt = colorfmt.replace('bgr', 'rgb')
+        applied['colorfmt'] = colorfmt
+
+    img = np.ascontiguousarray(img)
+    encoding = request.get('encoding', 'raw')
+    if encoding in ['jpeg', 'png']:
+        import cv2
+        ok, data = cv2.imencode('.jpg' if encoding == 'jpeg' else '.png', img)
+        array = data.tobytes()
+    elif encoding == 'lz4':
+        import lz4.frame
+        array = lz4.frame.compress(img.tobytes())
+    else:
+        encoding = 'raw'
+        array = img.tobytes()
+
+    sioimage = dict(shape=list(img.shape), array=array, dtype=img.dtype.name, **applied)
+    if encoding != 'raw':
+        sioimage['encoding'] = encoding
+    return sioimage
+
+
+class FakeDatahub:
+
+    def __init__(self, args):
+        import socketio
+
+        self.args = args
+        self.cameras = {}
+        self.configs = {}
+        self.jsonhub = {}
+        self.versions = {}
+        self.subscriptions = {}
+        self.answered = 0
+        self.dropped = 0
+
+        if args.jsonhub_file:
+            try:
+                with open(args.jsonhub_file) as f:
+                    self.jsonhub = json.load(f)
+            except FileNotFoundError:
+                pass
+
+        self.sio = sio = socketio.AsyncServer(async_mode='aiohttp', max_http_buffer_size=1 << 28)
+        sio.on('datahub.batch', self.batch)
+        sio.on('set_config', self.set_config)
+        sio.on('jsonhub.save', self.jsonhub_save)
+        sio.on('jsonhub.load', self.jsonhub_load)
+        sio.on('jsonhub.batch_save', self.jsonhub_batch_save)
+        sio.on('subscribe', self.subscribe)
+        sio.on('unsubscribe', self.unsubscribe)
+        sio.on('disconnect', self.disconnect)
+        sio.on('*', self.datahub)
+
+    def camera(self, path):
+        if path not in self.cameras:
+            name = path[len('datahub.'):]
+            self.cameras[path] = SyntheticCamera(name, self.args.width, self.args.height, self.args.fps)
+        return self.cameras[path]
+
+    def message(self, path, request):
+        img, aruco, seq, timestamp = self.camera(path).frame()
+        message = dict(aruco, image=encode_image(img, request), seq=seq, timestamp=timestamp)
+        return message
+
+    def should_drop(self):
+        if random.random() < self.args.drop_rate:
+            self.dropped += 1
+            return True
+        self.answered += 1
+        return False
+
+    async def respond(self):
+        # 模擬延遲與掉封包，要掉的請求就一直不回應，讓 client 自己逾時
+        if self.args.latency:
+            await asyncio.sleep(self.args.latency)
+        if self.should_drop():
+            await asyncio.sleep(3600)
+
+    async def datahub(self, event, sid, data=None):
+        if not event.startswith('datahub.'):
+            return None
+        await self.respond()
+        return self.message(event, data if isinstance(data, dict) else {})
+
+    async def batch(self, sid, data):
+        await self.respond()
+        request = dict(data)
+        paths = request.pop('paths')
+        return dict(frames={path: self.message(path, request) for path in paths})
+
+    async def set_config(self, sid, data):
+        await self.respond()
+        self.configs.setdefault(data['path'], {}).update(data['config'])
+        print('set_config', data['path'], json.dumps(data['config'])[:200])
+        return True
+
+    def save_jsonhub_file(self):
+        if self.args.jsonhub_file:
+            with open(self.args.jsonhub_file, 'w') as f:
+                json.dump(self.jsonhub, f, indent=4)
+
+    async def jsonhub_save(self, sid, data):
+        await self.respond()
+        self.jsonhub[data['id']] = data
+        self.versions[data['id']] = self.versions.get(data['id'], 0) + 1
+        self.save_jsonhub_file()
+        return True
+
+    async def jsonhub_batch_save(self, sid, data):
+        await self.respond()
+        if data.get('encoding') == 'zlib':
+            data = json.loads(zlib.decompress(data['payload']).decode('utf-8'))
+
+        results = {}
+        for op in data['docs']:
+            id = op['id']
+            version = self.versions.get(id, 0)
+            if 'full' in op:
+                self.jsonhub[id] = op['full']
+            elif op['base'] == version and id in self.jsonhub:
+                doc = self.jsonhub[id]
+                doc.update(op['set'])
+                for key in op['unset']:
+                    doc.pop(key, None)
+            else:
+                results[id] = dict(ok=False, version=version)
+                continue
+            self.versions[id] = version + 1
+            results[id] = dict(ok=True, version=version + 1)
+
+        self.save_jsonhub_file()
+        return dict(results=results)
+
+    async def jsonhub_load(self, sid, id):
+        await self.respond()
+        return self.jsonhub.get(id)
+
+    async def subscribe(self, sid, data):
+        key = (sid, data['path'])
+        self.unsubscribe(sid, data)
+        self.subscriptions[key] = self.sio.start_background_task(self._push, sid, dict(data))
+        return True
+
+    def unsubscribe(self, sid, data):
+        task = self.subscriptions.pop((sid, data['path']), None)
+        if task is not None:
+            task.cancel()
+        return True
+
+    def disconnect(self, sid):
+        for key in [key for key in self.subscriptions if key[0] == sid]:
+            self.subscriptions.pop(key).cancel()
+
+    async def _push(self, sid, request):
+        path = request.pop('path')
+        max_fps = request.pop('max_fps', None) or self.args.fps
+        interval = 1 / min(max_fps, self.args.fps)
+        while True:
+            start = time()
+            if not self.should_drop():
+                await self.sio.emit(path, self.message(path, request), to=sid)
+            await asyncio.sleep(max(0, interval - (time() - start)))
+
+    async def report(self):
+        # 每 5 秒印出回應的數量
+        while True:
+            await asyncio.sleep(5)
+            print('answered {} dropped {} subscriptions {}'.format(self.answered, self.dropped, len(self.subscriptions)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--drop-rate', type=float, default=0)
+    parser.add_argument('--jsonhub-file', default=None)
+    args = parser.parse_args()
+
+    from aiohttp import web
+
+    hub = FakeDatahub(args)
+    app = web.Application()
+    hub.sio.attach(app)
+
+    async def start_report(app):
+        app['report'] = asyncio.ensure_future(hub.report())
+    app.on_startup.append(start_report)
+
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+以 python -X importtime 檢查冷啟動的 import 成本
+
+    python benchmarks/import_budget.py --budget-ms 1500
+
+在新的 process 中 import kivyguidescreen 以及一組典型流程用到的畫面模組
+總時間超過 budget，或者載入了應該延後的重量級模組 (cv2, scipy, screeninfo) 時回傳非零的 exit code
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+
+TYPICAL_FLOW = [
+    'kivyguidescreen.screens.common',
+    'kivyguidescreen.screens.grideditor',
+    'kivyguidescreen.screensplus.cameraquad',
+    'kivyguidescreen.screensplus.locateprojector',
+    'kivyguidescreen.screensplus.verifyaruco',
+]
+
+DEFERRED_MODULES = ['cv2', 'scipy', 'screeninfo']
+
+
+def measure(modules):
+    code = 'import kivyguidescreen; kivyguidescreen.GuideScreenManager\n' + ''.join('import {}\n'.format(m) for m in modules)
+    env = dict(os.environ, KIVY_NO_ARGS='1', KIVY_NO_CONSOLELOG='1')
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+        raise SystemExit('import failed')
+
+    # 每行格式: import time: self [us] | cumulative | imported package
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = [it.strip() for it in line[len('import time:'):].split('|')]
+        entries.append((name.strip(), int(self_us), int(cumulative_us)))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--budget-ms', type=float, default=1500)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    entries = measure(TYPICAL_FLOW)
+    total_ms = sum(self_us for name, self_us, cumulative_us in entries) / 1000
+    loaded = {name.split('.')[0] for name, self_us, cumulative_us in entries}
+
+    print('slowest top-level imports:')
+    top_level = [it for it in entries if '.' not in it[0]]
+    for name, self_us, cumulative_us in sorted(top_level, key=lambda it: -it[2])[:args.top]:
+        print('  {:<40s} {:9.1f} ms'.format(name, cumulative_us / 1000))
+    print('total import time {:.1f} ms (budget {:.1f} ms)'.format(total_ms, args.budget_ms))
+
+    failed = False
+    for name in DEFERRED_MODULES:
+        if name in loaded:
+            print('FAIL: {} is imported at startup, it should be imported lazily'.format(name))
+            failed = True
+    if total_ms > args.budget_ms:
+        print('FAIL: import time exceeds the budget')
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
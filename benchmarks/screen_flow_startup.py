@@ -0,0 +1,47 @@
+"""
+量測建立一個多畫面流程的啟動時間
+
+    python benchmarks/screen_flow_startup.py --screens 40
+"""
+
+import argparse
+from time import perf_counter
+
+from kivy.properties import StringProperty
+
+from kivyguidescreen import GuideScreenManager, GuideScreen, GuideScreenVariable, ScreenFactory
+
+
+class BenchmarkScreen(GuideScreen):
+
+    source_node = StringProperty('datahub.dshowwebcam')
+
+    table_points_mm = GuideScreenVariable()
+    table_points_pixel = GuideScreenVariable()
+    lens_center_xyz = GuideScreenVariable(default=[0, 0, 1000])
+
+
+def timed(func):
+    start = perf_counter()
+    result = func()
+    return perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--screens', type=int, default=40)
+    args = parser.parse_args()
+    tags = [str(i) for i in range(args.screens)]
+
+    seconds, screens = timed(lambda: [BenchmarkScreen(tag=tag) for tag in tags])
+    print('instantiate {} screens        {:8.1f} ms'.format(args.screens, seconds * 1000))
+
+    seconds, gsm = timed(lambda: GuideScreenManager(guidescreens=[BenchmarkScreen(tag=tag) for tag in tags]))
+    print('manager with instances       {:8.1f} ms'.format(seconds * 1000))
+
+    seconds, gsm = timed(lambda: GuideScreenManager(guidescreens=[ScreenFactory(BenchmarkScreen, tag=tag) for tag in tags]))
+    print('manager with factories       {:8.1f} ms'.format(seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
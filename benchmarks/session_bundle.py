@@ -0,0 +1,72 @@
+"""
+比較 json + .npy 與單檔 session bundle 的存取時間
+
+    python benchmarks/session_bundle.py --pixelmaps 4 --width 3840 --height 2160
+"""
+
+import os
+import argparse
+import tempfile
+from time import perf_counter
+
+import numpy as np
+
+from kivyguidescreen.utils.autosave import SettingsJournal
+from kivyguidescreen.utils.denumpy import renumpy
+from kivyguidescreen.utils.bundle import save_bundle, load_bundle
+
+
+def make_session(num_pixelmaps, width, height, num_grids=40):
+    rng = np.random.default_rng(0)
+    settings = {'current': 'pixelmappingscreen', 'windowsize': [width, height]}
+    for i in range(num_pixelmaps):
+        settings['pixelmap_%d' % i] = rng.integers(0, 256, size=(height, width, 4), dtype=np.uint8)
+    for i in range(num_grids):
+        coords = rng.uniform(0, width, size=(9, 2)).round(2).tolist()
+        settings['grid_%d' % i] = dict(shape=[3, 3], coords=coords)
+    return settings
+
+
+def timed(func):
+    start = perf_counter()
+    result = func()
+    return perf_counter() - start, result
+
+
+def touch(settings):
+    # 把所有陣列讀過一次，讓 mmap 的成本也算進來
+    return sum(int(v[::64, ::64].sum()) for v in settings.values() if isinstance(v, np.ndarray))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pixelmaps', type=int, default=4)
+    parser.add_argument('--width', type=int, default=3840)
+    parser.add_argument('--height', type=int, default=2160)
+    args = parser.parse_args()
+
+    settings = make_session(args.pixelmaps, args.width, args.height)
+    nbytes = sum(v.nbytes for v in settings.values() if isinstance(v, np.ndarray))
+    print('session: {} pixelmaps {}x{} BGRA, {:.1f} MB of arrays'.format(args.pixelmaps, args.width, args.height, nbytes / 2**20))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        json_file = os.path.join(tmpdir, 'session.json')
+        bundle_file = os.path.join(tmpdir, 'session.npz')
+        journal = SettingsJournal(json_file)
+
+        rows = []
+        rows.append(('json save (new arrays)', timed(lambda: journal.write_snapshot(settings))[0]))
+        rows.append(('json save (unchanged)', timed(lambda: journal.write_snapshot(settings))[0]))
+        rows.append(('json load', timed(lambda: renumpy(journal.read(), tmpdir))[0]))
+        rows.append(('json load (lazy)', timed(lambda: renumpy(journal.read(), tmpdir, lazy=True))[0]))
+        rows.append(('bundle save', timed(lambda: save_bundle(bundle_file, settings))[0]))
+        rows.append(('bundle load', timed(lambda: load_bundle(bundle_file))[0]))
+        rows.append(('bundle load + touch', timed(lambda: touch(load_bundle(bundle_file)))[0]))
+        rows.append(('bundle load (no mmap)', timed(lambda: load_bundle(bundle_file, mmap=False))[0]))
+
+    for name, seconds in rows:
+        print('{:<28s} {:9.1f} ms'.format(name, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
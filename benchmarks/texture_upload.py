@@ -0,0 +1,86 @@
+"""
+比較 NumpyImage 上傳前的轉換: 原本每張影像 flatten 複製一次，與現在的 memoryview 加上重複使用的 staging buffer
+
+    python benchmarks/texture_upload.py --frames 100
+    python benchmarks/texture_upload.py --frames 100 --blit
+
+加上 --blit 時以隱藏的 kivy 視窗實際 blit_buffer 到 texture，否則只量測 cpu 端的轉換
+"""
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+
+from kivyguidescreen.utils.siotypes import prepare_frame, StagingBuffers
+
+
+RESOLUTIONS = {'720p': (1280, 720), '1080p': (1920, 1080), '4k': (3840, 2160)}
+
+
+def make_inputs(width, height):
+    rng = np.random.default_rng(0)
+    rgb = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    depth = rng.integers(0, 4096, size=(height, width), dtype=np.uint16)
+    return {
+        'rgb': rgb,
+        'rgb strided': rgb[:, ::-1],            # 水平翻轉後的 view
+        'rgb read-only': np.frombuffer(rgb.tobytes(), dtype=np.uint8).reshape(rgb.shape),     # 與 datahub 的 raw 影像相同
+        'depth uint16': depth,
+    }
+
+
+def flatten_upload(img, staging):
+    # 原本 on_numpy_image 的做法
+    if img.dtype == np.uint16:
+        img = np.uint8(img.clip(1, 4000)/16.)
+    colorfmt = 'luminance' if img.ndim == 2 else 'rgb'
+    return img.flatten(), colorfmt, None
+
+
+def staged_upload(img, staging):
+    frame = prepare_frame(img, staging=staging)
+    return frame.buffer, frame.colorfmt, frame.staged
+
+
+def run(upload, img, frames, texture=None):
+    # 回傳每秒可以處理的影像數
+    staging = StagingBuffers()
+    start = perf_counter()
+    for _ in range(frames):
+        buffer, colorfmt, staged = upload(img, staging)
+        if texture is not None:
+            texture.blit_buffer(buffer, colorfmt=colorfmt, bufferfmt='ubyte')
+        staging.release(staged)
+    return frames / (perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--blit', action='store_true')
+    args = parser.parse_args()
+
+    if args.blit:
+        import os
+        os.environ.setdefault('KIVY_NO_ARGS', '1')
+        from kivy.config import Config
+        Config.set('graphics', 'window_state', 'hidden')
+        from kivy.core.window import Window  # 建立 gl context
+        from kivy.graphics.texture import Texture
+
+    print('{:<8s}{:<16s}{:>12s}{:>12s}{:>9s}'.format('size', 'input', 'before fps', 'after fps', 'ratio'))
+    for name, (width, height) in RESOLUTIONS.items():
+        for kind, img in make_inputs(width, height).items():
+            texture = None
+            if args.blit:
+                colorfmt = 'luminance' if img.ndim == 2 else 'rgb'
+                texture = Texture.create(size=(width, height), colorfmt=colorfmt, bufferfmt='ubyte')
+
+            before_fps = run(flatten_upload, img, args.frames, texture)
+            after_fps = run(staged_upload, img, args.frames, texture)
+            print('{:<8s}{:<16s}{:>12.1f}{:>12.1f}{:>8.2f}x'.format(name, kind, before_fps, after_fps, after_fps / before_fps))
+
+
+if __name__ == '__main__':
+    main()
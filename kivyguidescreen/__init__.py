@@ -1 +1,9 @@
-from .guidescreenmanager import GuideScreenManager, GuideScreen, GuideScreenVariable
+# GuideScreenManager 等類別在第一次取用時才載入 kivy，讓 kivyguidescreen.utils 可以單獨使用
+__all__ = ['GuideScreenManager', 'GuideScreen', 'GuideScreenVariable', 'ScreenFactory']
+
+
+def __getattr__(name):
+    if name in __all__:
+        from . import guidescreenmanager
+        return getattr(guidescreenmanager, name)
+    raise AttributeError("module 'kivyguidescreen' has no attribute " + repr(name))
@@ -1,13 +1,77 @@
 from kivy.clock import Clock
 from kivy.core.window import Window
-from screeninfo import get_monitors
+
+
+class MonitorRegistry:
+
+    """
+    快取 screeninfo.get_monitors() 的結果
+
+    列舉顯示器要詢問視窗系統，成本不低，所以只在第一次使用或呼叫 refresh() 時才立即列舉
+    之後每 poll_interval 秒在背景重新列舉一次，插拔顯示器不必改變視窗大小也能發現
+    (switch_to_monitor 自己造成的視窗大小改變不會觸發重新列舉)
+    內容有變動時才換成新的 list，可以用 is 判斷內容是否變過
+    """
+
+    def __init__(self, poll_interval=5):
+        self.poll_interval = poll_interval
+        self._monitors = None
+        self._poll_event = None
+        self._polling = False
+
+    def monitors(self):
+        if self._monitors is None:
+            self._monitors = self._enumerate()
+            self._start_polling()
+        return self._monitors
+
+    def refresh(self, *args):
+        self._monitors = None
+
+    @staticmethod
+    def _enumerate():
+        from screeninfo import get_monitors
+        return get_monitors()
+
+    @staticmethod
+    def _layout(monitors):
+        return [(m.x, m.y, m.width, m.height) for m in monitors]
+
+    def _start_polling(self):
+        if self._poll_event is None:
+            self._poll_event = Clock.schedule_interval(self._poll, self.poll_interval)
+
+    def _poll(self, dt):
+        # 在背景執行緒列舉，不卡住主執行緒，結果有變動時才回到主執行緒換掉快取
+        import threading
+
+        if self._polling:
+            return
+        self._polling = True
+
+        def enumerate_monitors():
+            try:
+                monitors = self._enumerate()
+            except Exception:
+                monitors = None
+            Clock.schedule_once(lambda dt: self._update(monitors))
+
+        threading.Thread(target=enumerate_monitors, name='monitor-poll', daemon=True).start()
+
+    def _update(self, monitors):
+        self._polling = False
+        if monitors is not None and self._monitors is not None and self._layout(monitors) != self._layout(self._monitors):
+            self._monitors = monitors
+
+
+monitor_registry = MonitorRegistry()
 
 
 class SwitchMonitorBehavior:
 
     @property
     def monitor_options(self):
-        return get_monitors()
+        return monitor_registry.monitors()
 
     def switch_to_monitor(self, monitor_option):        
         x, y, w, h = [getattr(monitor_option, name) for name in ['x', 'y', 'width', 'height']]
@@ -17,4 +81,4 @@ class SwitchMonitorBehavior:
         self.upload_to_manager(windowsize=[w, h])
         def fullscreen(dt):
             Window.fullscreen = 'auto'
-        Clock.schedule_once(fullscreen, 0.1)
\ No newline at end of file
+        Clock.schedule_once(fullscreen, 0.1)
@@ -1,21 +1,69 @@
 from kivy.uix.screenmanager import ScreenManager, FadeTransition, Screen
-from kivy.properties import BooleanProperty, ListProperty, StringProperty, OptionProperty, ObjectProperty, DictProperty
+from kivy.properties import BooleanProperty, NumericProperty, ListProperty, StringProperty, OptionProperty, ObjectProperty, DictProperty
 from kivy.graphics import InstructionGroup, Line, Color
 
 from kivy.utils import QueryDict
 
 import os
-import json
 
 from kivy.core.window import Window
 from kivy.base import stopTouchApp
+from kivy.clock import Clock
+from kivy.logger import Logger
 
 # set traditional chinese font
 from kivy.resources import resource_add_path
 pkgpath = os.path.dirname(__file__)
 resource_add_path(pkgpath)
 
-from .utils.denumpy import denumpy, renumpy
+from .utils.denumpy import renumpy, realize
+from .utils.autosave import SettingsJournal, AutosaveWriter, snapshot_containers
+from .utils.bundle import save_bundle, load_bundle
+from .utils.instrument import pipeline_stats
+
+
+ARROW_DXDY = {
+    'up'    : (0, 1),
+    'down'  : (0, -1),
+    'left'  : (-1, 0),
+    'right' : (1, 0)
+}
+
+NUMPAD_ARROWS = {'2':'down', '4':'left', '6':'right', '8':'up'}
+
+SHORTCUT_HANDLERS = {'enter':'on_press_enter', 'backspace':'undo', 'spacebar':'on_press_space', 'tab':'on_press_tab'}
+
+KEY_HANDLER_NAMES = ['on_press_arrow', 'on_key_down'] + list(SHORTCUT_HANDLERS.values())
+
+
+class SettingsDict(QueryDict):
+
+    # manager.settings 用的 QueryDict，lazy 載入的陣列在任何讀取時才開啟並存回
+    # 序列化 (denumpy、snapshot_containers) 以 dict.items 取值，不會觸發載入
+    # 寫入請一律經過 manager.update_settings，GuideScreenVariable 的快取才會跟著更新
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        realized = realize(value)
+        if realized is not value:
+            dict.__setitem__(self, key, realized)
+        return realized
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return dict.pop(self, key, *default)
+
+    def values(self):
+        return [self[k] for k in self]
+
+    def items(self):
+        return [(k, self[k]) for k in self]
 
 
 class GuideScreenManager(ScreenManager):
@@ -32,19 +80,44 @@ class GuideScreenManager(ScreenManager):
 
     title = StringProperty('')
 
-    settings = QueryDict({})
+    settings = SettingsDict({})
 
     cursor_offset = ListProperty([0, 0])
     subpixel_cursor = ListProperty([0, 0])
 
     wallpaper = ObjectProperty(None, allownone=True)
 
+    # autosave 日誌累積多少筆之後重寫一次完整的 snapshot
+    journal_compact_every = NumericProperty(50)
+
+    # 連續的 autosave 在安靜多少秒之後才合併寫入
+    autosave_delay = NumericProperty(0.5)
+
+    # 各畫面類別的按鍵處理表，見 key_handlers()
+    _key_handler_tables = {}
+
     default_address = StringProperty('http://localhost:8080')
     #default_address = StringProperty('http://192.168.0.11:8080') # 泓軒電腦
     #default_address = StringProperty('http://192.168.0.19:8080') # left
     #default_address = StringProperty('http://192.168.0.18:8080') # 台電機器
 
+    # 等候 datahub 連線或回應的秒數，超過就放棄這次請求
+    socketio_request_timeout = NumericProperty(5)
+
+    # pipeline_overlay_key 顯示影像管線的統計，pipeline_export_key 把統計附加到 pipeline_stats_file
+    # 只有畫面沒有處理這個按鍵時才有作用，設為 '' 可以停用
+    pipeline_overlay_key = StringProperty('f3')
+    pipeline_export_key = StringProperty('f4')
+    pipeline_stats_file = StringProperty('pipeline_stats.csv')
+
+    # jsonhub 的本機快取與尚未送達的儲存，每個 datahub 位址一個子資料夾
+    jsonhub_cache_dir = StringProperty('jsonhub_cache')
+
     def __init__(self, **kw):
+        # 畫面的順序，以及延後建立的畫面
+        self._screen_flow = []
+        self._screen_factories = {}
+
         super(GuideScreenManager, self).__init__(**kw)
         Window.show_cursor = False
 
@@ -54,16 +127,35 @@ class GuideScreenManager(ScreenManager):
             Window.set_title(self.title)
             self.tempfile = self.title.replace(' ', '').lower() + '.json'
 
+        # autosave 只記錄變動過的變數，第一次 autosave 時才寫出完整的 snapshot
+        # 寫檔在背景執行緒進行，不阻塞畫面
+        self._journal = SettingsJournal(self.tempfile)
+        self._autosave_writer = AutosaveWriter(self._journal, on_error=self._on_autosave_failed)
+        self._unsaved_keys = set()
+        self.register_event_type('on_autosave_error')
+
+        # 每個變數被寫入的次數，讓讀取端可以快取到下次變動為止
+        # load_settings 整個換掉 settings 時改變 generation
+        self._settings_versions = {}
+        self._settings_generation = 0
+
         # keyboard
         self._keyboard = Window.request_keyboard(self._keyboard_closed, self)
         self._keyboard.bind(on_key_down=self._on_keyboard_down)
 
         # cursor things
+        # 游標的指令只建立一次，之後只更新座標，並且每個 frame 最多重畫一次
         with self.canvas.after:
             self.cursor_instruction = InstructionGroup()
-
-        self.bind(current=self._draw_cursor)
-        self.bind(on_enter=self._draw_cursor)
+        self._cursor_color = Color(1, 1, 1, 0)
+        self._cursor_v_line = Line(points=[], width=0.25)
+        self._cursor_h_line = Line(points=[], width=0.25)
+        for ins in [self._cursor_color, self._cursor_v_line, self._cursor_h_line]:
+            self.cursor_instruction.add(ins)
+        self._trigger_draw_cursor = Clock.create_trigger(self._draw_cursor)
+
+        self.bind(current=self._trigger_draw_cursor)
+        self.bind(on_enter=self._trigger_draw_cursor)
         self.bind(cursor_offset=self._move_cursor)
         Window.bind(mouse_pos=self._move_cursor)
 
@@ -73,19 +165,33 @@ class GuideScreenManager(ScreenManager):
         # socketio serve stuff
         self.socketio_clients = {}
         self.socketio_client_screen_map = {}
+        self._socketio_pool = None
+
+        # 影像管線的統計以畫面為單位
+        self._pipeline_overlay = None
+        self._pipeline_overlay_routine = None
+        self.bind(current=self._set_pipeline_scope)
 
         Window.bind(on_close=self.on_window_closed)
 
         # 載入所有畫面，並從頭開始
+        # ScreenFactory 要等到第一次進入該畫面時才建立
         for sc in self.guidescreens:
-            self.add_widget(sc)
+            if isinstance(sc, ScreenFactory):
+                self._screen_factories[sc.name] = sc
+                self._screen_flow.append(sc.name)
+            else:
+                self.add_widget(sc)
 
         self.current = self.guidescreens[0].name
 
 
     def on_window_closed(self, *arg):
-        for client in self.socketio_clients.values():
-            client.disconnect()
+        # 等背景的 autosave 寫完再離開
+        self._autosave_writer.flush(timeout=5)
+
+        if self._socketio_pool is not None:
+            self._socketio_pool.close()
 
 
 
@@ -102,13 +208,15 @@ class GuideScreenManager(ScreenManager):
         if address is None:
             address = self.default_address
 
-        import socketio
-        
+        # 連線在背景進行，這裡不會等到連上才返回
+        if self._socketio_pool is None:
+            from .utils.siopool import SocketIOPool
+            self._socketio_pool = SocketIOPool(request_timeout=self.socketio_request_timeout)
+
         if address in self.socketio_clients:
             sio = self.socketio_clients[address]
         else:
-            self.socketio_clients[address] = sio = socketio.Client()
-            sio.connect(address)
+            self.socketio_clients[address] = sio = self._socketio_pool.connection(address)
 
         self.socketio_client_screen_map[screen] = sio
 
@@ -116,8 +224,37 @@ class GuideScreenManager(ScreenManager):
 
 
 
-    def load_settings(self, settings):
-        self.settings = QueryDict(renumpy(settings))
+    def update_settings(self, **kw):
+        self.settings.update(kw)
+        self._unsaved_keys.update(kw)
+        versions = self._settings_versions
+        for k in kw:
+            versions[k] = versions.get(k, 0) + 1
+
+
+    def settings_version(self, varname):
+        return self._settings_generation, self._settings_versions.get(varname, 0)
+
+
+    def read_autosave(self):
+        with self._autosave_writer.io_lock:
+            return self._journal.read()
+
+
+    def read_settings(self, filename):
+        # .npz 是單檔的 session bundle，陣列以 mmap 對應，其餘是 json 加上日誌
+        if filename.endswith('.npz'):
+            return load_bundle(filename)
+        return SettingsJournal(filename).read()
+
+
+    def load_settings(self, settings, basedir='', lazy=False):
+        self.settings = SettingsDict(renumpy(settings, basedir, lazy))
+        self._settings_generation += 1
+
+        # autosave 的日誌是以舊的 settings 為基礎，下一次 autosave 重寫完整的 snapshot
+        self._unsaved_keys.clear()
+        self._autosave_writer.invalidate()
         screen_to_go = self.get_screen(settings['current'])
         self.current = settings['current']
 
@@ -147,33 +284,34 @@ class GuideScreenManager(ScreenManager):
 
 
     def on_subpixel_cursor(self, *args):
-        self._draw_cursor()
+        self._trigger_draw_cursor()
+
+
+    def update_cursor_state(self, *args):
+        self._trigger_draw_cursor()
 
 
     def _draw_cursor(self, *args):
-        cursor = self.current_screen.cursor
-        ins = self.cursor_instruction
-        if cursor == 'hidden':
-            ins.clear()
+        if self.current_screen is None:
             return
 
-        # 清理上一輪畫的 cursor
-        x, y = self.subpixel_cursor
-        ins.clear()
-        ins.add(Color(1, 1, 1))
+        cursor = self.current_screen.cursor
+        if cursor == 'hidden' or not cursor.endswith('cross'):
+            self._cursor_color.a = 0
+            return
 
         # 畫出 cross 類型的 cursor
-        if cursor.endswith('cross'):
-            v_points, h_points = None, None
-            if cursor.startswith('big'):
-                v_points = [x, 0, x, Window.height]
-                h_points = [0, y, Window.width, y]
-            elif cursor.startswith('tiny'):
-                v_points = [x, y-20, x, y+20]
-                h_points = [x-20, y, x+20, y]                
+        x, y = self.subpixel_cursor
+        if cursor.startswith('big'):
+            v_points = [x, 0, x, Window.height]
+            h_points = [0, y, Window.width, y]
+        else:
+            v_points = [x, y-20, x, y+20]
+            h_points = [x-20, y, x+20, y]
 
-            ins.add(Line(points=v_points, width=0.25))
-            ins.add(Line(points=h_points, width=0.25))
+        self._cursor_v_line.points = v_points
+        self._cursor_h_line.points = h_points
+        self._cursor_color.a = 1
 
 
     def _keyboard_closed(self):
@@ -182,71 +320,194 @@ class GuideScreenManager(ScreenManager):
 
 
 
+    def add_widget(self, screen, *args, **kwargs):
+        # 註冊畫面時就先建好該類別的按鍵處理表
+        self.key_handlers(type(screen))
+        if screen.name not in self._screen_flow:
+            self._screen_flow.append(screen.name)
+        super(GuideScreenManager, self).add_widget(screen, *args, **kwargs)
+
+
+    @property
+    def screen_flow(self):
+        # 所有畫面的名稱，包含還沒建立的
+        return self._screen_flow
+
+
+    def get_screen(self, name):
+        if name in self._screen_factories and not self.has_screen(name):
+            screen = self._screen_factories[name].create()
+            screen.bind(on_leave=self._release_screen)
+            self.add_widget(screen)
+        return super(GuideScreenManager, self).get_screen(name)
+
+
+    def _release_screen(self, screen):
+        # 離開後釋放標記為 release_on_leave 的畫面，再次進入時由 ScreenFactory 重建
+        if not screen.release_on_leave:
+            return
+
+        def release(dt):
+            if screen is self.current_screen or screen.manager is not self:
+                return
+            self.socketio_client_screen_map.pop(screen, None)
+            self.remove_widget(screen)
+
+        Clock.schedule_once(release, 0)
+
+
+    def next(self):
+        flow = self._screen_flow
+        if self.current not in flow:
+            return super(GuideScreenManager, self).next()
+        return flow[(flow.index(self.current) + 1) % len(flow)]
+
+
+    def previous(self):
+        flow = self._screen_flow
+        if self.current not in flow:
+            return super(GuideScreenManager, self).previous()
+        return flow[(flow.index(self.current) - 1) % len(flow)]
+
+
+    @classmethod
+    def key_handlers(cls, screen_class):
+        # 每個畫面類別只查一次有哪些按鍵處理函數，避免每次按鍵都對 kivy widget 呼叫 dir()
+        try:
+            return cls._key_handler_tables[screen_class]
+        except KeyError:
+            table = frozenset(name for name in KEY_HANDLER_NAMES if callable(getattr(screen_class, name, None)))
+            cls._key_handler_tables[screen_class] = table
+            return table
+
+
     def _on_keyboard_down(self, keyboard, keycode, text, modifiers):
 
-        mouse_dxdy = {
-            'up'    : (0, 1),
-            'down'  : (0, -1),
-            'left'  : (-1, 0),
-            'right' : (1, 0)
-        }
-        
+        screen = self.current_screen
+        handlers = self.key_handlers(type(screen))
+
         keyname = keycode[1]
         if keyname.startswith('numpad'):
             keyname = keyname[6:]
             if keyname == 'decimal':
                 keyname = '.'
-            if self.current_screen.numpad_as_arrows and keyname in ['2', '4', '6', '8']:
-                keyname = {'2':'down', '4':'left', '6':'right', '8':'up'}[keyname]
+            if screen.numpad_as_arrows and keyname in NUMPAD_ARROWS:
+                keyname = NUMPAD_ARROWS[keyname]
 
-        if keyname in ['up', 'down', 'left', 'right']:
-            dx, dy = mouse_dxdy[keyname]
+        if keyname in ARROW_DXDY:
+            dx, dy = ARROW_DXDY[keyname]
             px, py = self.cursor_offset
             self.cursor_offset = [px + dx*0.25, py + dy*0.25]
-            if 'on_press_arrow' in dir(self.current_screen):
-                self.current_screen.on_press_arrow(keyname=keyname, dxdy=[dx, dy])
+            if 'on_press_arrow' in handlers:
+                screen.on_press_arrow(keyname=keyname, dxdy=[dx, dy])
             return True
-        elif self.current_screen.switch_monitor_by_digitkey and keyname in '123456789':
-            screen = self.current_screen
-            if len(screen.monitor_options) < int(keyname) and 'on_key_down' in dir(self.current_screen):
-                return self.current_screen.on_key_down(keyname, modifiers)
+        elif screen.switch_monitor_by_digitkey and keyname in '123456789':
+            if len(screen.monitor_options) < int(keyname) and 'on_key_down' in handlers:
+                return screen.on_key_down(keyname, modifiers)
             target_monitor = screen.monitor_options[int(keyname) - 1]
             screen.switch_to_monitor(target_monitor)
         else:
-            mapping = {'enter':'on_press_enter', 'backspace':'undo', 'spacebar':'on_press_space', 'tab':'on_press_tab'}
-
-            if keyname in mapping:
-                shortcut_func_name = mapping[keyname]
+            shortcut_func_name = SHORTCUT_HANDLERS.get(keyname)
 
-            if (keyname in mapping) and (shortcut_func_name in dir(self.current_screen)):
-                func = getattr(self.current_screen, shortcut_func_name)
+            if shortcut_func_name in handlers:
+                func = getattr(screen, shortcut_func_name)
                 return func()
-            elif 'on_key_down' in dir(self.current_screen):
-                return self.current_screen.on_key_down(keyname, modifiers)
+            elif 'on_key_down' in handlers:
+                consumed = screen.on_key_down(keyname, modifiers)
+                if consumed:
+                    return consumed
+
+            # 畫面沒有處理的按鍵才拿來操作影像管線的統計
+            if not keyname:
+                return
+            elif keyname == self.pipeline_overlay_key:
+                self.toggle_pipeline_overlay()
+                return True
+            elif keyname == self.pipeline_export_key:
+                self.export_pipeline_stats()
+                return True
+
+
+    def _set_pipeline_scope(self, *args):
+        pipeline_stats.scope = self.current
+
+
+    def toggle_pipeline_overlay(self):
+        if self._pipeline_overlay is not None:
+            self._pipeline_overlay_routine.cancel()
+            Window.remove_widget(self._pipeline_overlay)
+            self._pipeline_overlay = self._pipeline_overlay_routine = None
+            return
+
+        from kivy.uix.label import Label
+        overlay = Label(size=Window.size, halign='left', valign='top', font_size=14,
+                        color=[1, 1, 0, 1], padding=[20, 20])
+        overlay.text_size = overlay.size
+
+        def update(*args):
+            overlay.text = pipeline_stats.format() + '\n\n{} 關閉  {} 匯出至 {}'.format(
+                self.pipeline_overlay_key.upper(), self.pipeline_export_key.upper(), self.pipeline_stats_file)
+
+        update()
+        Window.add_widget(overlay)
+        self._pipeline_overlay = overlay
+        self._pipeline_overlay_routine = Clock.schedule_interval(update, 0.5)
+
+
+    def export_pipeline_stats(self):
+        pipeline_stats.export_csv(self.pipeline_stats_file)
+        Logger.info('GuideScreenManager: pipeline stats appended to ' + self.pipeline_stats_file)
 
 
     def autosave(self, *args):
         if self.current_screen.autosave is False:
             return
-        self.save_settings(self.tempfile)
+
+        self.update_settings(current=self.current)
+        settings = self.settings
+
+        # 主執行緒只複製 settings 的結構與這次變動的陣列，序列化與寫檔交給背景執行緒
+        snapshot = snapshot_containers(settings, self._unsaved_keys)
+        changes = {k: snapshot[k] for k in self._unsaved_keys if k in snapshot}
+        changes['current'] = self.current
+        self._unsaved_keys.clear()
+
+        writer = self._autosave_writer
+        writer.delay = self.autosave_delay
+        writer.compact_every = self.journal_compact_every
+        writer.request(changes, snapshot)
+
+
+    def _on_autosave_failed(self, exception):
+        # 由背景執行緒呼叫，轉回主執行緒通知
+        Clock.schedule_once(lambda dt: self.dispatch('on_autosave_error', exception), 0)
+
+
+    def on_autosave_error(self, exception):
+        Logger.error('GuideScreenManager: autosave to {} failed: {!r}'.format(self.tempfile, exception))
 
 
     def save_settings(self, filename):
+        self.update_settings(current=self.current)
         settings = self.settings
-        settings.current = self.current
         try:
-            # could fail here
-            with open(filename + '.bak', 'w') as tempfile:
-                json.dump(denumpy(settings), tempfile, indent=4)
-            # delete previous autosave file and replace it
-            if os.path.isfile(filename):
-                os.remove(filename)
-            os.rename(filename + '.bak', filename)
+            if filename == self.tempfile:
+                # 與背景的 autosave 共用同一份日誌
+                # 先等排隊中的寫入完成再持有 io_lock，舊的 autosave 才不會蓋掉這次的 snapshot
+                # (背景寫入本身需要 io_lock，不能在持有 io_lock 時 flush)
+                writer = self._autosave_writer
+                writer.flush()
+                with writer.io_lock:
+                    self._journal.write_snapshot(settings)
+                    writer.mark_synced()
+                    self._unsaved_keys.clear()
+            elif filename.endswith('.npz'):
+                save_bundle(filename, settings)
+            else:
+                SettingsJournal(filename).write_snapshot(settings)
         except:
             import traceback
             traceback.print_exc()
-            # remove corrupted file
-            os.remove(filename + '.bak')
 
 
     def on_wallpaper(self, caller, wallpaper):
@@ -272,6 +533,35 @@ from .behaviors import SwitchMonitorBehavior
 import copy
 
 
+class ScreenFactory:
+
+    """
+    延後建立的畫面，可以放在 guidescreens 中代替畫面物件
+
+        ScreenFactory(CameraQuadScreen, tag='left', camera_node='datahub.leftcam')
+
+    畫面在第一次進入時才建立，release_on_leave 為 True 的畫面離開後會被釋放
+    """
+
+    def __init__(self, screen_class, tag=None, **kw):
+        self.screen_class = screen_class
+        self.tag = tag
+        self.kw = kw
+
+        # 與 GuideScreen 自動產生頁面名稱的規則相同
+        self._name = kw.get('name', screen_class.__name__.lower() + ('-' + tag if tag else ''))
+
+    @property
+    def name(self):
+        return self._name
+
+    def create(self):
+        kw = dict(self.kw, name=self._name)
+        if self.tag is not None:
+            kw['tag'] = self.tag
+        return self.screen_class(**kw)
+
+
 class GuideScreenVariable:
 
     def __init__(self, default=None, name=None, screen=None):
@@ -279,15 +569,43 @@ class GuideScreenVariable:
         self._name = name
         self._screen = screen
 
+        # (版本, 值) 的快取，manager 中的變數被寫入後版本就會改變
+        self._cache = None
+        self._derived = {}
+
     @property
     def name(self):
         return self._name
 
+    @property
+    def version(self):
+        return self._screen.settings_version(self._name)
+
     def read(self):
-        try:
-            return self._screen.load_from_manager(self._name)
-        except KeyError:
-            return self.default
+        # 與 load_from_manager 相同，dict 每次都回傳新的 QueryDict，修改它不會影響快取
+        version = self.version
+        if self._cache is None or self._cache[0] != version:
+            try:
+                value = self._screen.load_from_manager(self._name)
+            except KeyError:
+                value = self.default
+            self._cache = (version, value)
+
+        value = self._cache[1]
+        if isinstance(value, dict):
+            value = QueryDict(value)
+        return value
+
+    def derive(self, func):
+        # 回傳 func(self.read())，直到變數被寫入前都不重算
+        version = self.version
+        cached = self._derived.get(func)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        value = func(self.read())
+        self._derived[func] = (version, value)
+        return value
 
     def write(self, value):
         return self._screen.upload_to_manager(**{self._name:value})
@@ -315,6 +633,12 @@ class GuideScreen(Screen, SwitchMonitorBehavior):
     autosave = BooleanProperty(True)
     numpad_as_arrows = BooleanProperty(False)
 
+    # 由 ScreenFactory 建立的畫面離開後是否釋放
+    release_on_leave = BooleanProperty(False)
+
+    # 類別宣告的 GuideScreenVariable 名稱，由 __init_subclass__ 產生
+    _gsv_names = ()
+
     def __init__(self, tag=None, **kw):
 
         # 自動產生頁面名稱
@@ -334,17 +658,18 @@ class GuideScreen(Screen, SwitchMonitorBehavior):
 
         super(GuideScreen, self).__init__(**kw)
 
+    def __init_subclass__(cls, **kw):
+        super().__init_subclass__(**kw)
+
+        # 在類別建立時就記下所有的 GuideScreenVariable (gsv) 宣告，不必每個 instance 都掃一次 dir()
+        names = set()
+        for klass in cls.__mro__:
+            names.update(name for name in vars(klass) if not name.startswith('_'))
+        cls._gsv_names = tuple(sorted(name for name in names if isinstance(getattr(cls, name, None), GuideScreenVariable)))
+
     def _list_guidescreen_variables(self):
         # 列出所有的 GuideScreenVariable (gsv)
-        #return [varname for varname in vars(self) if isinstance(getattr(self, varname), GuideScreenVariable)]
-        gsv_names = []
-        for varname in [it for it in dir(self) if not it.startswith('_')]:
-            try:
-                if isinstance(getattr(self, varname), GuideScreenVariable):
-                    gsv_names.append(varname)
-            except AttributeError:
-                pass
-        return gsv_names
+        return list(type(self)._gsv_names)
 
     def _generate_gsv_instances(self, gsv_names, var_remap):
         # 針對每個 GuideScreenVariable 產生一個 instance 在自己物件內
@@ -373,7 +698,7 @@ class GuideScreen(Screen, SwitchMonitorBehavior):
             self.manager.update_cursor_state()
 
     def goto_next_screen(self, *args):
-        if self.manager.current_screen == self.manager.screens[-1]:
+        if self.manager.current == self.manager.screen_flow[-1]:
             return
         self.manager.current = self.manager.next()
 
@@ -383,6 +708,11 @@ class GuideScreen(Screen, SwitchMonitorBehavior):
     def goto_previous_screen(self, *args):
         self.manager.current = self.manager.previous()
 
+    def settings_version(self, varname):
+        if varname in self.inter_screen_var_remap:
+            varname = self.inter_screen_var_remap[varname]
+        return self.manager.settings_version(varname)
+
     def load_from_manager(self, varname):
         if varname in self.inter_screen_var_remap:
             varname = self.inter_screen_var_remap[varname]
@@ -400,7 +730,7 @@ class GuideScreen(Screen, SwitchMonitorBehavior):
             new_name = self.inter_screen_var_remap[original_name]
             kw[new_name] = kw.pop(original_name)
 
-        self.manager.settings.update(kw)
+        self.manager.update_settings(**kw)
 
     def save_settings(self, filename):
         self.manager.save_settings(filename)
@@ -1,5 +1,4 @@
 import numpy as np
-import cv2
 from .. import GuideScreenManager, GuideScreen
 
 from kivy.properties import NumericProperty, BooleanProperty, ListProperty, StringProperty, DictProperty
@@ -169,6 +168,7 @@ class TableHomographyScreen(PickQuadCornersScreen):
 
 
     def find_homography(self, *args):
+        import cv2
         if len(self.state.corners) < 4:
             raise Exception("Not enough corners provided")
 
@@ -1,14 +1,16 @@
 import os
-import json
 
 from kivy.utils import QueryDict
 
 from .. import GuideScreenManager, GuideScreen
-from ..behaviors import SwitchMonitorBehavior
+from ..behaviors import SwitchMonitorBehavior, monitor_registry
 
 
 class SetupScreen(GuideScreen, SwitchMonitorBehavior):
 
+    # (顯示器列表, 選項) 的快取，顯示器重新列舉之後才重建選項
+    _options_cache = None
+
 
     def load_option(self, option):
     
@@ -65,6 +67,10 @@ class SetupScreen(GuideScreen, SwitchMonitorBehavior):
 
     @property
     def options(self):
+        monitors = self.monitor_options
+        if self._options_cache is not None and self._options_cache[0] is monitors:
+            return self._options_cache[1]
+
         options = []
         options += self.generate_monitor_options()
         #options += self.generate_kinectv2_options()
@@ -73,10 +79,14 @@ class SetupScreen(GuideScreen, SwitchMonitorBehavior):
         for idx, opt in enumerate(options):
             key = str(idx+1)
             ret_options[key] = opt
+
+        self._options_cache = (monitors, ret_options)
         return ret_options
 
 
     def on_enter(self):
+        # 進入設定畫面時重新列舉一次顯示器
+        monitor_registry.refresh()
         self.ids.guidelabel.halign = 'left'
         self.guide = '請輸入數字選擇校正的目標:\n\n'
         for key, opt in self.options.items():
@@ -114,10 +124,9 @@ class LoadAutoSaveScreen(GuideScreen):
 
 
     def load_autosave(self):
-        with open(self.manager.tempfile) as tempfile:
-            temp_settings = json.load(tempfile)
-
-        self.manager.load_settings(temp_settings)
+        temp_settings = self.manager.read_autosave()
+        # 陣列延後到第一次讀取時才以 mmap 開啟，接續大型進度不必等待
+        self.manager.load_settings(temp_settings, basedir=os.path.dirname(self.manager.tempfile), lazy=True)
 
 
 
@@ -1,13 +1,28 @@
-from kivy.properties import StringProperty
+from kivy.properties import StringProperty, OptionProperty, NumericProperty
 
 from kivyguidescreen import GuideScreen
 from kivyguidescreen.widgets.numpyimage import NumpyImage
 
 from kivy.clock import Clock, mainthread
 
+from kivyguidescreen.utils.siosource import FrameSubscription, LatestPoller, connect_node
+from kivyguidescreen.utils.siotypes import image_request, IMAGE_ENCODINGS
+from kivyguidescreen.utils.jsonhub import jsonhub_cache
+
 
 class JsonHubInterface:
 
+    """
+    讀寫都先經過本機快取 (見 utils/jsonhub.py 的 JsonHubCache)
+    load 時若有快取會先以快取呼叫 on_json_loaded，server 上的內容不同時再以新內容呼叫一次
+    save 先存進本機的佇列，server 回應之後以 {id: dict(ok, version)} 呼叫 on_json_saved
+    兩者都在主執行緒上被呼叫
+    """
+
+    def _jsonhub_cache(self):
+        assert 'socketio_client' in dir(self)
+        return jsonhub_cache(self.socketio_client, self.manager.jsonhub_cache_dir)
+
 
     def save_to_jsonhub(self, id, parameters):
         # 檢查名稱
@@ -16,13 +31,16 @@ class JsonHubInterface:
         parameters['id'] = id
 
         # 送出
-        assert 'socketio_client' in dir(self)
-        self.socketio_client.emit(event='jsonhub.save', data=parameters, namespace=None, callback=self.on_json_saved)
+        self._jsonhub_cache().save_many({id: parameters}, callback=mainthread(self.on_json_saved))
+
+
+    def save_many_to_jsonhub(self, documents, compress=True):
+        # documents 是 {id: parameters}，一次送出，而且只送與 server 上一版不同的 key
+        self._jsonhub_cache().save_many(documents, callback=mainthread(self.on_json_saved), compress=compress)
 
 
     def load_from_jsonhub(self, id):
-        assert 'socketio_client' in dir(self)
-        self.socketio_client.emit(event='jsonhub.load', data=id, namespace=None, callback=self.on_json_loaded)
+        self._jsonhub_cache().load(id, callback=mainthread(self.on_json_loaded))
 
 
     def on_json_loaded(self, *args):
@@ -43,6 +61,14 @@ class NumpyImageScreen(GuideScreen):
 
     source_node = StringProperty('datahub.dshowwebcam')
 
+    # poll: 每 1/30 秒索取一張影像，最多 max_in_flight 個請求等待回應   subscribe: 由 server 推送影像，速率跟著 server 走
+    frame_mode = OptionProperty('poll', options=['poll', 'subscribe'])
+    max_in_flight = NumericProperty(1)
+
+    # 向 datahub 要求的影像倍率與編碼，見 siotypes.image_request
+    source_scale = NumericProperty(1.)
+    source_encoding = OptionProperty('raw', options=IMAGE_ENCODINGS)
+
     def __init__(self, **kw):
         super().__init__(**kw)
         self.bind(on_enter=self._on_enter)
@@ -51,16 +77,19 @@ class NumpyImageScreen(GuideScreen):
 
     def _on_enter(self, caller):
         self._routine = None
-        Clock.schedule_once(self._connect, 0.1)
-
-
-    def _connect(self, dt):
-        self.socketio_client.emit(event=self.source_node.lower(), data='', namespace=None, callback=self._on_connected)
+        self._subscription = None
+        self._connector = connect_node(self.socketio_client, self.source_node.lower(), self._on_connected, delay=0.1)
 
 
     def _on_connected(self, *args):
         self.anchor_y = 'top'
-        self._routine = Clock.schedule_interval(self._retrieve_camera_view, 1/30)
+        request = image_request(self.source_encoding, self.source_scale)
+        if self.frame_mode == 'subscribe':
+            self._subscription = FrameSubscription(self.socketio_client, self.source_node.lower(), self._show_frame, request=request)
+            self._subscription.start()
+        else:
+            self._poller = LatestPoller(self.socketio_client, self.source_node.lower(), self._on_receive_frame, max_in_flight=self.max_in_flight, data=request)
+            self._routine = Clock.schedule_interval(self._retrieve_camera_view, 1/30)
         self.on_connected(*args)
 
 
@@ -69,18 +98,28 @@ class NumpyImageScreen(GuideScreen):
 
 
     def _on_leave(self, caller):
+        self._connector.cancel()
         if self._routine:
             self._routine.cancel()
             self._routine = None
+            self._poller.reset()
+        if self._subscription:
+            self._subscription.stop()
+            self._subscription = None
 
 
     def _retrieve_camera_view(self, dt):
-        self.socketio_client.emit(event=self.source_node.lower(), data='', namespace=None, callback=self._on_receive_frame)
+        self._poller.poll()
 
 
     @mainthread
     def _on_receive_frame(self, message):
+        self._show_frame(message)
+
+
+    def _show_frame(self, message):
         self.ids.npimg.sio_image = message['image']
+        (self._subscription or self._poller).negotiate_colorfmt(message['image'])
         self.on_receive_frame(message)
 
 
@@ -1,18 +1,20 @@
 from kivy.clock import Clock
-from kivy.properties import NumericProperty, ObjectProperty, StringProperty, ListProperty, DictProperty
+from kivy.properties import NumericProperty, ObjectProperty, StringProperty, ListProperty, DictProperty, OptionProperty
 from kivyguidescreen import GuideScreen, GuideScreenManager
 
 from kivyguidescreen.widgets.numpyimage import NumpyImage
 from kivyguidescreen.widgets.grideditor import GridEditor, Grid
 
 import numpy as np
-import cv2
 
 from kivy.clock import Clock, mainthread
 
 from kivyguidescreen.utils.armath import PerspectiveTransform, find_homography
 
 from kivyguidescreen.utils.recursive import recursive_round
+from kivyguidescreen.utils.siosource import FrameSubscription, LatestPoller, connect_node
+from kivyguidescreen.utils.siotypes import image_request, IMAGE_ENCODINGS
+from kivyguidescreen.utils.instrument import pipeline_stats
 
 
 
@@ -23,6 +25,15 @@ class CameraQuadScreen(GuideScreen):
     """
     camera_node = StringProperty('datahub.dshowwebcam')
 
+    # poll: 每 1/30 秒索取一張影像，最多 max_in_flight 個請求等待回應   subscribe: 由 server 推送影像
+    frame_mode = OptionProperty('poll', options=['poll', 'subscribe'])
+    max_in_flight = NumericProperty(1)
+
+    # 預覽用的影像倍率與編碼，例如 0.5 與 jpeg 可大幅降低傳輸量
+    # 四邊形的座標以及送給 topview_node 的設定仍然以原始解析度的像素為單位
+    preview_scale = NumericProperty(1.)
+    preview_encoding = OptionProperty('raw', options=IMAGE_ENCODINGS)
+
     # 從桌面 grid 中取出 quad 用
     table_grid_mm = StringProperty("table_grid_mm")
     row_shift = NumericProperty(0)
@@ -44,35 +55,56 @@ class CameraQuadScreen(GuideScreen):
         self.anchor_y = 'center'
         self.guide = '連線中....'
         self._routine = None
-        Clock.schedule_once(self._connect, 0.1)
-
-
-    def _connect(self, dt):
-        self.socketio_client.emit(event=self.camera_node.lower(), data='', namespace=None, callback=self._on_connect)
+        self._subscription = None
+        self.ids.npimg.bind(numpy_image=self._on_camera_image)
+        self._connector = connect_node(self.socketio_client, self.camera_node.lower(), self._on_connect, delay=0.1)
 
 
     def _on_connect(self, *args):
         self.anchor_y = 'top'
-        self._routine = Clock.schedule_interval(self._retrieve_camera_view, 1/30)
+        request = image_request(self.preview_encoding, self.preview_scale)
+        if self.frame_mode == 'subscribe':
+            self._subscription = FrameSubscription(self.socketio_client, self.camera_node.lower(), self._show_frame, request=request)
+            self._subscription.start()
+        else:
+            self._poller = LatestPoller(self.socketio_client, self.camera_node.lower(), self._on_receive_frame, max_in_flight=self.max_in_flight, data=request)
+            self._routine = Clock.schedule_interval(self._retrieve_camera_view, 1/30)
 
 
     def on_leave(self):
+        self._connector.cancel()
+        self.ids.npimg.unbind(numpy_image=self._on_camera_image)
         if self._routine:
             self._routine.cancel()
             self._routine = None
+            self._poller.reset()
+        if self._subscription:
+            self._subscription.stop()
+            self._subscription = None
 
 
     def _retrieve_camera_view(self, dt):
-        self.socketio_client.emit(event=self.camera_node.lower(), data='', namespace=None, callback=self._on_receive_frame)
+        self._poller.poll()
 
 
     @mainthread
     def _on_receive_frame(self, message):
+        self._show_frame(message)
+
+
+    def _show_frame(self, message):
         self.ids.npimg.sio_image = message['image']
+        (self._subscription or self._poller).negotiate_colorfmt(message['image'])
         if not self._grid_initialized:
             self.init_grideditor()
             self._grid_initialized = True
 
+
+    def _on_camera_image(self, npimg, numpy_image):
+        # 影像在背景解碼，解碼完成 (numpy_image 更新) 之後才畫上視圖
+        if numpy_image is None or not self._grid_initialized:
+            return
+
         # 畫出上視圖
         self._render_topview()
         w, h = self._topview_resolution
@@ -96,6 +128,7 @@ class CameraQuadScreen(GuideScreen):
 
 
     def _render_topview(self):
+        import cv2
         # 計算感應邊界在相機影像中的位置
         x, y = self.sensor_area.pos
         w, h = self.sensor_area.size
@@ -112,16 +145,24 @@ class CameraQuadScreen(GuideScreen):
 
         # 產生把相機影像貼到一張圖上的 homography
         crop_output_pixel = (np.float32([(0, 0), (w, 0), (w, h), (0, h)]) * output_scale).tolist()
-        topview_homography = find_homography(srcPoints=sensor_area_in_camera_pixel, dstPoints=crop_output_pixel)
-
-        self.ids.topview.numpy_image = cv2.warpPerspective(
-            self.ids.npimg.numpy_image,
-            topview_homography,
-            self._topview_resolution,
-            #flags=cv2.INTER_NEAREST,
-            #borderMode=cv2.BORDER_CONSTANT,
-            #borderValue=(255,255,255,255)
-        )
+
+        # 預覽影像可能是縮小過的，上視圖也以相同倍率計算
+        scale = self.ids.npimg.image_scale
+        topview_homography = find_homography(
+            srcPoints=(np.float32(sensor_area_in_camera_pixel) * scale).tolist(),
+            dstPoints=(np.float32(crop_output_pixel) * scale).tolist())
+
+        with pipeline_stats.measure('warp:cameraquad'):
+            topview = cv2.warpPerspective(
+                self.ids.npimg.numpy_image,
+                topview_homography,
+                [max(1, round(n * scale)) for n in self._topview_resolution],
+                #flags=cv2.INTER_NEAREST,
+                #borderMode=cv2.BORDER_CONSTANT,
+                #borderValue=(255,255,255,255)
+            )
+        self.ids.topview.image_scale = scale
+        self.ids.topview.numpy_image = topview
         self._camera_to_table_quad_pairs = list(zip(sensor_area_in_camera_pixel, crop_output_pixel))
 
 
@@ -158,6 +199,7 @@ Builder.load_string("""
 <CameraQuadScreen>:
 
     switch_monitor_by_digitkey: True
+    release_on_leave: True
     cursor: 'tiny cross'
     background: 0, 0, .1
 
@@ -176,7 +218,7 @@ Builder.load_string("""
                 NumpyImage:
                     id: npimg
                     size_hint: None, None
-                    size: self.texture_size
+                    size: [n / self.image_scale for n in self.texture_size]
                     Scatter:
                         pos: npimg.pos
                         do_rotation: False
@@ -195,6 +237,8 @@ Builder.load_string("""
                     anchor_y: 'center'
                     NumpyImage:
                         id: topview
+                        # warpPerspective 不改變通道順序
+                        colorfmt: npimg.frame_colorfmt or 'auto'
                         size_hint: None, None
-                        size: self.texture_size
+                        size: [n / self.image_scale for n in self.texture_size]
 """)
\ No newline at end of file
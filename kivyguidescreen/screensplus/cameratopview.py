@@ -4,15 +4,18 @@ from kivyguidescreen import GuideScreen, GuideScreenManager
 
 from kivyguidescreen.widgets.numpyimage import NumpyImage
 
-import cv2
 import numpy as np
 
 from kivy.clock import Clock, mainthread
 
+from kivyguidescreen.utils.siosource import LatestPoller, connect_node
+
 
 
 class CameraTopviewScreen(GuideScreen):
 
+    max_in_flight = NumericProperty(1)
+
 
     def __init__(self,
                  boundary,
@@ -28,22 +31,28 @@ class CameraTopviewScreen(GuideScreen):
         self._draw_aruco_node = (draw_aruco_node if draw_aruco_node.startswith('datahub.') else 'datahub.' + draw_aruco_node).lower()
         self._corner_sets = []
         self._homography = None
+        self._median_aruco_corners = None
 
     def on_enter(self):
         self.guide = "正在與伺服器連線中... 請稍候"
 
-        @mainthread
-        def init_guide(*arg):
-            self.guide = '請將 Aruco 放到桌面中央處以設定大致的原點'
-
-        self.socketio_client.emit(event=self._aruco_node, data='', namespace=None, callback=init_guide)
+        self._connector = connect_node(self.socketio_client, self._aruco_node, self._init_guide)
+        self.ids.camera_image.bind(numpy_image=self._on_camera_image)
+        self._poller = LatestPoller(self.socketio_client, self._draw_aruco_node, self._on_receive_aruco_view, max_in_flight=self.max_in_flight)
         self._routine = Clock.schedule_interval(self._retrive_aruco_view, 1/30)
 
 
+    def _init_guide(self, *args):
+        self.guide = '請將 Aruco 放到桌面中央處以設定大致的原點'
+
+
     def on_leave(self):
+        self._connector.cancel()
+        self.ids.camera_image.unbind(numpy_image=self._on_camera_image)
         if self._routine:
             self._routine.cancel()
             self._routine = None
+            self._poller.reset()
 
     def on_press_space(self):
         self.guide = '擷取中..'
@@ -111,6 +120,7 @@ class CameraTopviewScreen(GuideScreen):
 
 
     def _find_homography(self, corners):
+        import cv2
         aruco_corners = np.array(corners, dtype=np.float32)
 
         # 以第一組頂點為基準算出一個 homography
@@ -153,21 +163,31 @@ class CameraTopviewScreen(GuideScreen):
         median_aruco_corners = [coord_mediam(corner_samples) for corner_samples in four_corner_samples]
 
         ### _corner_sets 變數原本設計給多次採樣，但現在暫時只用一次採樣
-        self._find_homography(median_aruco_corners)
-        self.guide = "已定位 Aruco 並轉出上視圖，檢查上視圖中的 Aruco 形狀是否接近正方形以確認其準確性"
+        # 影像在背景解碼，homography 等下一張影像解碼完成時再計算 (需要影像尺寸)
+        self._median_aruco_corners = median_aruco_corners
 
 
     def _retrive_aruco_view(self, dt):
-        self.socketio_client.emit(event=self._draw_aruco_node, data='', namespace=None, callback=self._on_receive_aruco_view)
+        self._poller.poll()
 
 
     @mainthread
     def _on_receive_aruco_view(self, message):
         self.ids.camera_image.sio_image = message['image']
+        self._poller.negotiate_colorfmt(message['image'])
+
+
+    def _on_camera_image(self, widget, camera_image):
+        import cv2
+        if camera_image is None:
+            return
+
+        if self._median_aruco_corners is not None:
+            self._find_homography(self._median_aruco_corners)
+            self._median_aruco_corners = None
+            self.guide = "已定位 Aruco 並轉出上視圖，檢查上視圖中的 Aruco 形狀是否接近正方形以確認其準確性"
+
         if self._homography is not None:
-            sioimage = message['image']
-            shape, array, dtype = [sioimage[it] for it in ['shape', 'array', 'dtype']]
-            camera_image = np.frombuffer(array, dtype=dtype).reshape(*shape)
             self.ids.topview.numpy_image = cv2.warpPerspective(
                 camera_image,
                 self._homography,
@@ -205,5 +225,7 @@ Builder.load_string("""
 
             NumpyImage:
                 id: topview
+                # warpPerspective 不改變通道順序
+                colorfmt: camera_image.frame_colorfmt or 'auto'
 
 """)
\ No newline at end of file
@@ -4,17 +4,20 @@ from kivyguidescreen import GuideScreen, GuideScreenManager
 
 from kivyguidescreen.widgets.numpyimage import NumpyImage
 
-import cv2
 import numpy as np
 
-from kivy.clock import Clock, mainthread
+from kivy.clock import Clock
 
+from kivyguidescreen.utils.siosource import connect_node
+from kivyguidescreen.utils.siotypes import sioimage_to_numpy
+from kivyguidescreen.utils.instrument import pipeline_stats
+from kivyguidescreen.screensplus.pairedcameras import PairedCameraBehavior
 
-from kivy.core.window import Window
 
+from kivy.core.window import Window
 
-class GridInCameraScreen(GuideScreen):
 
+class GridInCameraScreen(GuideScreen, PairedCameraBehavior):
 
     def __init__(self, camera_nodes, **kw):
         super().__init__(**kw)
@@ -27,12 +30,8 @@ class GridInCameraScreen(GuideScreen):
     def on_enter(self):
         self.guide = "正在與伺服器連線中... 請稍候"
 
-        @mainthread
-        def init_guide(*arg):
-            self.guide = '請將 Aruco 放到桌面中央處以設定大致的原點'
-
-        self.socketio_client.emit(event='datahub.' + self._camera_nodes[0].lower(), data='', namespace=None, callback=init_guide)
-        self._routines = [Clock.schedule_interval(self._retrive_camera_view, 1/30),
+        self._connector = connect_node(self.socketio_client, 'datahub.' + self._camera_nodes[0].lower(), self._init_guide)
+        self._routines = [self._start_paired_views(self._camera_nodes, 'gridincamera'),
                           Clock.schedule_interval(self._ui_routine, 1/60)]
 
 
@@ -46,37 +45,24 @@ class GridInCameraScreen(GuideScreen):
             self.ids.left_grideditor.disabled = True
 
 
-    def _retrive_camera_view(self, dt):
-        for node_id in self._camera_nodes:
-            self.socketio_client.emit(event='datahub.' + node_id.lower(), data='', namespace=None, callback=self._on_receive_camera_view(node_id))
-
-
-    def _on_receive_camera_view(self, node_id):
-        @mainthread
-        def handle_camera_view(message):
-            # 將影像顯示於畫面
-            idx = self._camera_nodes.index(node_id)
-            npimg_id = ['left_camera', 'right_camera'][idx]
-            self.ids[npimg_id].sio_image = message['image']
-
-            # 第一次讀到影像
-            if not self._init_grid:
-                self.ids.right_grideditor.init_grid(shape=(2,2))
-                self.ids.left_grideditor.init_grid(shape=(2,2))
-                self._init_grid = True
+    def _on_paired_view(self, idx, message):
+        # 第一次讀到影像
+        if not self._init_grid:
+            self.ids.right_grideditor.init_grid(shape=(2,2))
+            self.ids.left_grideditor.init_grid(shape=(2,2))
+            self._init_grid = True
 
 
-            # 當 Homography 準備好的時候就直接算出完整的組合影像
-            if self._ready_to_merge_view:
-                self._show_merged_view()
-
-        return handle_camera_view
+    def _init_guide(self, *args):
+        self.guide = '請將 Aruco 放到桌面中央處以設定大致的原點'
 
 
     def on_leave(self):
-        if self._routine:
-            self._routine.cancel()
-            self._routine = None
+        self._connector.cancel()
+        for routine in self._routines:
+            routine.cancel()
+        self._routines = []
+        self._stop_paired_views()
 
 
     def on_press_space(self):
@@ -91,6 +77,7 @@ class GridInCameraScreen(GuideScreen):
 
 
     def _find_homography(self):
+        import cv2
 
         # 定義找出 aruco median 的方法
         def find_median(aruco_samples):
@@ -115,13 +102,17 @@ class GridInCameraScreen(GuideScreen):
         left_homography, mask = cv2.findHomography(srcPoints=left_aruco_median, dstPoints=ref_corners)
         right_homography, mask = cv2.findHomography(srcPoints=right_aruco_median, dstPoints=ref_corners)
 
-        # 計算左右影像邊緣被 homography 轉換的落點
+        # 影像在背景解碼，左右都解碼完成之前無法計算，等下一張影像再試
         left_numpy = self.ids.left_camera.numpy_image
+        right_numpy = self.ids.right_camera.numpy_image
+        if left_numpy is None or right_numpy is None:
+            return
+
+        # 計算左右影像邊緣被 homography 轉換的落點
         h, w = left_numpy.shape[:2]
         left_image_corners = np.array([[[0, 0], [w, 0], [w, h], [0, h]]], dtype=np.float32)
         left_output_image_corners = cv2.perspectiveTransform(left_image_corners, left_homography)
 
-        right_numpy = self.ids.right_camera.numpy_image
         h, w = right_numpy.shape[:2]
         right_image_corners = np.array([[[0, 0], [w, 0], [w, h], [0, h]]], dtype=np.float32)
         right_output_image_corners = cv2.perspectiveTransform(right_image_corners, right_homography)
@@ -154,54 +145,35 @@ class GridInCameraScreen(GuideScreen):
         self._ready_to_merge_view = True
 
 
-    ### 未來這個函數應該要移除放到一個 siotypes 模組
-    @staticmethod
-    def sioimage_to_numpy(sioimage):
-        shape = sioimage['shape']
-        array = sioimage['array']
+    sioimage_to_numpy = staticmethod(sioimage_to_numpy)
 
-        def find_dtype(shape, array):
-            if len(shape) == 3:
-                dtype = np.uint8
-            elif len(shape) == 2:
-                h, w = shape[0:2]
-                bytes_per_pixel = len(array) / (h * w)
 
-                if bytes_per_pixel == 1:
-                    dtype = np.uint8
-                elif bytes_per_pixel == 2:
-                    dtype = np.uint16
-
-            return dtype
-
-        dtype = find_dtype(shape, array)
-        return np.frombuffer(array, dtype=dtype).reshape(*shape)
-
-
-    @mainthread
-    def _show_merged_view(self):
+    def _show_merged_view(self, images):
+        import cv2
+        if not self._ready_to_merge_view:
+            return
         self.guide = "已定位 Aruco 並轉出上視圖，檢查上視圖中的 Aruco 形狀是否接近正方形以確認其準確性"
 
-        left_numpy = self.ids.left_camera.numpy_image
-        left_topview = cv2.warpPerspective(
-                left_numpy,
-                self._left_homography,
-                self._merged_size).reshape(-1)
-
-        right_numpy = self.ids.right_camera.numpy_image
-        right_topview = cv2.warpPerspective(
-                right_numpy,
-                self._right_homography,
-                self._merged_size).reshape(-1)
-
-        w, h = self._merged_size
-        img = np.zeros(shape=(h, w), dtype=np.uint8).reshape(-1)
-        left_idx_arr = (self._left_mask > 0) & (self._right_mask < 255)
-        img[left_idx_arr] = left_topview[left_idx_arr]
-        right_idx_arr = (self._right_mask > 0) & (self._left_mask < 255)
-        img[right_idx_arr] = right_topview[right_idx_arr]
-        merged_index_arr = (self._left_mask > 0) & (self._right_mask > 0)
-        img[merged_index_arr] = (left_topview[merged_index_arr] / 2 + right_topview[merged_index_arr] /2)
+        with pipeline_stats.measure('warp:gridincamera'):
+            left_numpy, right_numpy = images
+            left_topview = cv2.warpPerspective(
+                    left_numpy,
+                    self._left_homography,
+                    self._merged_size).reshape(-1)
+
+            right_topview = cv2.warpPerspective(
+                    right_numpy,
+                    self._right_homography,
+                    self._merged_size).reshape(-1)
+
+            w, h = self._merged_size
+            img = np.zeros(shape=(h, w), dtype=np.uint8).reshape(-1)
+            left_idx_arr = (self._left_mask > 0) & (self._right_mask < 255)
+            img[left_idx_arr] = left_topview[left_idx_arr]
+            right_idx_arr = (self._right_mask > 0) & (self._left_mask < 255)
+            img[right_idx_arr] = right_topview[right_idx_arr]
+            merged_index_arr = (self._left_mask > 0) & (self._right_mask > 0)
+            img[merged_index_arr] = (left_topview[merged_index_arr] / 2 + right_topview[merged_index_arr] /2)
         self.ids.merge_view.numpy_image = img.reshape(h, w)
 
 
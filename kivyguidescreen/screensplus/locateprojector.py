@@ -1,5 +1,4 @@
 import numpy as np
-import cv2
 from kivy.graphics import Line, Color, Point, InstructionGroup
 from kivy.clock import Clock
 from kivy.core.window import Window
@@ -8,6 +7,7 @@ from kivyguidescreen import GuideScreen, GuideScreenManager, GuideScreenVariable
 from kivy.properties import StringProperty, DictProperty, NumericProperty
 
 from kivyguidescreen.utils import armath
+from kivyguidescreen.screens.ue4client import JsonHubInterface
 
 
 
@@ -113,7 +113,7 @@ class VarifyElevatedQuadScreen(GuideScreen):
 
 
 
-class ReportProjectorParameterScreen(GuideScreen):
+class ReportProjectorParameterScreen(GuideScreen, JsonHubInterface):
 
     lens_center_xyz = GuideScreenVariable()
     table_points_pixel = GuideScreenVariable()
@@ -155,15 +155,30 @@ class ReportProjectorParameterScreen(GuideScreen):
 
 
     def upload_projector_parameters(self, dt):
-        self.socketio_client.emit(event='jsonhub.save', data=self.projector_parameters, namespace=None, callback=self.on_done_uploading)
+        # 這次校正過的所有投影機一起送出，沒有變動的部分不會重送
+        documents = dict(self.manager.settings.get('calibrated_projectors', {}))
+        documents[self.projector_id] = self.projector_parameters
+        self.save_many_to_jsonhub(documents)
 
 
-    def on_done_uploading(self, *args):
-        self.state_guide = '\n已將校正檔傳送至伺服器儲存為 ' + self.projector_id + '.json\n'
+    def on_json_saved(self, results):
+        # JsonHubInterface 已經在主執行緒上呼叫
+        self.on_done_uploading(results)
+
+
+    def on_done_uploading(self, results):
+        failed = [id for id, result in results.items() if not result.get('ok')]
+        if failed:
+            # 沒送達的儲存留在本機佇列，JsonHubCache 會自動重送
+            self.state_guide = '\n伺服器還沒確認儲存 ' + ', '.join(failed) + '，已排入佇列，連上伺服器後會自動重送\n'
+        else:
+            self.state_guide = '\n已將校正檔傳送至伺服器儲存為 ' + self.projector_id + '.json\n'
 
 
     def on_press_enter(self):
-        self.upload_to_manager(projector_parameters=self.projector_parameters)
+        calibrated = dict(self.manager.settings.get('calibrated_projectors', {}))
+        calibrated[self.projector_id] = self.projector_parameters
+        self.upload_to_manager(projector_parameters=self.projector_parameters, calibrated_projectors=calibrated)
         self.goto_next_screen()
 
 
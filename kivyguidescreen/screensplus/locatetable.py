@@ -8,7 +8,6 @@ from kivyguidescreen.widgets.grideditor import GridEditor, Grid
 from kivy.uix.label import Label
 
 import numpy as np
-import cv2 
 from kivy.clock import Clock, mainthread
 
 class TableGuideScreen(GuideScreen):
@@ -1,19 +1,20 @@
-from kivy.clock import Clock
 from kivy.properties import NumericProperty, ObjectProperty, StringProperty
 from kivyguidescreen import GuideScreen, GuideScreenManager
 
 from kivyguidescreen.widgets.numpyimage import NumpyImage
 from kivyguidescreen.widgets.quadeditor import QuadEditor
 
-import cv2
 import numpy as np
 
-from kivy.clock import Clock, mainthread
 
+from kivyguidescreen.utils.siosource import connect_node
+from kivyguidescreen.utils.siotypes import sioimage_to_numpy
+from kivyguidescreen.utils.instrument import pipeline_stats
+from kivyguidescreen.screensplus.pairedcameras import PairedCameraBehavior
 
 
-class MergeCameraViewScreen(GuideScreen):
 
+class MergeCameraViewScreen(GuideScreen, PairedCameraBehavior):
 
     def __init__(self,
                  output_aruco_size,
@@ -34,18 +35,20 @@ class MergeCameraViewScreen(GuideScreen):
     def on_enter(self):
         self.guide = "正在與伺服器連線中... 請稍候"
 
-        @mainthread
-        def init_guide(*arg):
-            self.guide = '請將 Aruco 放到桌面中央處以設定大致的原點'
+        self._connector = connect_node(self.socketio_client, 'datahub.' + self._draw_aruco_nodes[0], self._init_guide)
+        self._routine = self._start_paired_views(self._draw_aruco_nodes, 'mergeview')
 
-        self.socketio_client.emit(event='datahub.' + self._draw_aruco_nodes[0], data='', namespace=None, callback=init_guide)
-        self._routine = Clock.schedule_interval(self._retrive_aruco_view, 1/30)
+
+    def _init_guide(self, *args):
+        self.guide = '請將 Aruco 放到桌面中央處以設定大致的原點'
 
 
     def on_leave(self):
+        self._connector.cancel()
         if self._routine:
             self._routine.cancel()
             self._routine = None
+            self._stop_paired_views()
 
 
     def on_press_space(self):
@@ -60,6 +63,7 @@ class MergeCameraViewScreen(GuideScreen):
 
 
     def _find_homography(self):
+        import cv2
 
         # 定義找出 aruco median 的方法
         def find_median(aruco_samples):
@@ -84,13 +88,17 @@ class MergeCameraViewScreen(GuideScreen):
         left_homography, mask = cv2.findHomography(srcPoints=left_aruco_median, dstPoints=ref_corners)
         right_homography, mask = cv2.findHomography(srcPoints=right_aruco_median, dstPoints=ref_corners)
 
-        # 計算左右影像邊緣被 homography 轉換的落點
+        # 影像在背景解碼，左右都解碼完成之前無法計算，等下一張影像再試
         left_numpy = self.ids.left_camera.numpy_image
+        right_numpy = self.ids.right_camera.numpy_image
+        if left_numpy is None or right_numpy is None:
+            return
+
+        # 計算左右影像邊緣被 homography 轉換的落點
         h, w = left_numpy.shape[:2]
         left_image_corners = np.array([[[0, 0], [w, 0], [w, h], [0, h]]], dtype=np.float32)
         left_output_image_corners = cv2.perspectiveTransform(left_image_corners, left_homography)
 
-        right_numpy = self.ids.right_camera.numpy_image
         h, w = right_numpy.shape[:2]
         right_image_corners = np.array([[[0, 0], [w, 0], [w, h], [0, h]]], dtype=np.float32)
         right_output_image_corners = cv2.perspectiveTransform(right_image_corners, right_homography)
@@ -123,87 +131,51 @@ class MergeCameraViewScreen(GuideScreen):
         self._ready_to_merge_view = True
 
 
-    def _retrive_aruco_view(self, dt):
-        for node_id in self._draw_aruco_nodes:
-            self.socketio_client.emit(event='datahub.' + node_id.lower(), data='', namespace=None, callback=self._on_receive_aruco_view(node_id))
-
-
-    ### 未來這個函數應該要移除放到一個 siotypes 模組
-    @staticmethod
-    def sioimage_to_numpy(sioimage):
-        shape = sioimage['shape']
-        array = sioimage['array']
-
-        def find_dtype(shape, array):
-            if len(shape) == 3:
-                dtype = np.uint8
-            elif len(shape) == 2:
-                h, w = shape[0:2]
-                bytes_per_pixel = len(array) / (h * w)
-
-                if bytes_per_pixel == 1:
-                    dtype = np.uint8
-                elif bytes_per_pixel == 2:
-                    dtype = np.uint16
-
-            return dtype
+    sioimage_to_numpy = staticmethod(sioimage_to_numpy)
 
-        dtype = find_dtype(shape, array)
-        return np.frombuffer(array, dtype=dtype).reshape(*shape)
 
+    def _on_paired_view(self, idx, message):
+        # 將新影像塞入計算清單
+        aruco_queue = [self._left_queue, self._right_queue][idx]
+        if len(aruco_queue) < self._capture_window_size:
+            aruco_contours = message['contours']
+            if len(aruco_contours) != 1:
+                from kivy.logger import Logger
+                Logger.warn('Exactly 1 arucos are expected. Found '+ str(len(aruco_contours)))
+                return False
+            aruco_queue.append(aruco_contours[0])
 
-    def _on_receive_aruco_view(self, node_id):
-        @mainthread
-        def handle_aruco_view(message):
-            # 將影像顯示於畫面
-            idx = self._draw_aruco_nodes.index(node_id)
-            npimg_id = ['left_camera', 'right_camera'][idx]
-            self.ids[npimg_id].sio_image = message['image']
+        # 兩列都塞滿時計算 Homography
+        if not self._ready_to_merge_view and len(self._left_queue) == len(self._right_queue) == self._capture_window_size:
+            self._find_homography()
 
-            # 將新影像塞入計算清單
-            aruco_queue = [self._left_queue, self._right_queue][idx]
-            if len(aruco_queue) < self._capture_window_size:
-                aruco_contours = message['contours']
-                if len(aruco_contours) != 1:
-                    from kivy.logger import Logger
-                    Logger.warn('Exactly 1 arucos are expected. Found '+ str(len(aruco_contours)))
-                    return
-                aruco_queue.append(aruco_contours[0])
-                if len(self._left_queue) == len(self._right_queue) == self._capture_window_size:
-                    # 兩列都塞滿時計算 Homography
-                    self._find_homography()
 
-            # 當 Homography 準備好的時候就直接算出完整的組合影像
-            if self._ready_to_merge_view:
-                self._show_merged_view()
-
-        return handle_aruco_view
-
-
-    @mainthread
-    def _show_merged_view(self):
+    def _show_merged_view(self, images):
+        import cv2
+        if not self._ready_to_merge_view:
+            return
         self.guide = "已定位 Aruco 並轉出上視圖，檢查上視圖中的 Aruco 形狀是否接近正方形以確認其準確性"
 
-        left_numpy = self.ids.left_camera.numpy_image
-        left_topview = cv2.warpPerspective(
-                left_numpy,
-                self._left_homography,
-                self._merged_size).reshape(-1)
-
-        right_numpy = self.ids.right_camera.numpy_image
-        right_topview = cv2.warpPerspective(
-                right_numpy,
-                self._right_homography,
-                self._merged_size).reshape(-1)
-
-        w, h = self._merged_size
-        img = np.zeros(shape=(h, w), dtype=np.uint8).reshape(-1)
-        left_idx_arr = (self._left_mask > 0) & (self._right_mask < 255)
-        img[left_idx_arr] = left_topview[left_idx_arr]
-        right_idx_arr = (self._right_mask > 0) & (self._left_mask < 255)
-        img[right_idx_arr] = right_topview[right_idx_arr]
-        merged_index_arr = (self._left_mask > 0) & (self._right_mask > 0)
-        img[merged_index_arr] = (left_topview[merged_index_arr] / 2 + right_topview[merged_index_arr] /2)
+        with pipeline_stats.measure('warp:mergeview'):
+            left_numpy, right_numpy = images
+            left_topview = cv2.warpPerspective(
+                    left_numpy,
+                    self._left_homography,
+                    self._merged_size).reshape(-1)
+
+            right_topview = cv2.warpPerspective(
+                    right_numpy,
+                    self._right_homography,
+                    self._merged_size).reshape(-1)
+
+            w, h = self._merged_size
+            img = np.zeros(shape=(h, w), dtype=np.uint8).reshape(-1)
+            left_idx_arr = (self._left_mask > 0) & (self._right_mask < 255)
+            img[left_idx_arr] = left_topview[left_idx_arr]
+            right_idx_arr = (self._right_mask > 0) & (self._left_mask < 255)
+            img[right_idx_arr] = right_topview[right_idx_arr]
+            merged_index_arr = (self._left_mask > 0) & (self._right_mask > 0)
+            img[merged_index_arr] = (left_topview[merged_index_arr] / 2 + right_topview[merged_index_arr] /2)
         self.ids.merge_view.numpy_image = img.reshape(h, w)
 
 
@@ -216,6 +188,7 @@ Builder.load_string("""
 <MergeCameraViewScreen>:
 
     cursor: 'tiny cross'
+    release_on_leave: True
     background: 0, 0, .1
 
     anchor_y: 'bottom'
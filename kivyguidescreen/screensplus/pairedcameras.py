@@ -0,0 +1,88 @@
+from kivy.clock import Clock, mainthread
+from kivy.properties import NumericProperty, BooleanProperty
+
+from kivyguidescreen.utils.siosource import LatestPoller, FramePairer, batch_request
+from kivyguidescreen.utils.siotypes import FrameDecoder
+
+
+class PairedCameraBehavior:
+
+    """
+    輪詢左右兩個 datahub 節點的影像，顯示在 ids.left_camera 與 ids.right_camera
+    並依 timestamp 把同一時間點的左右影像配成一組，_ready_to_merge_view 為 True 時在背景解碼後合併
+
+    使用的畫面需要實作
+        _on_paired_view(idx, message)   每收到一張影像時在主執行緒呼叫，回傳 False 時這次不合併
+        _show_merged_view(images)       在主執行緒以解碼好的 [左, 右] 影像呼叫
+    """
+
+    max_in_flight = NumericProperty(1)
+
+    # 輪詢的間隔秒數
+    frame_interval = NumericProperty(1/30)
+
+    # 以一個 datahub.batch 請求同時取回左右影像
+    batch_fetch = BooleanProperty(False)
+
+    # 配對時左右 timestamp 可以相差的秒數，None 時為 frame_interval
+    # 兩台各自運作的相機，影像時間最多相差一個 frame，再嚴格就會配不到大部分的影像
+    pair_tolerance = NumericProperty(None, allownone=True)
+
+    def _start_paired_views(self, nodes, stage):
+        # stage 是 pipeline_stats 中合併前解碼的階段名稱
+        self._paired_nodes = nodes
+
+        tolerance = self.frame_interval if self.pair_tolerance is None else self.pair_tolerance
+        self._pairer = FramePairer(len(nodes), tolerance=tolerance)
+        self._merge_decoder = FrameDecoder(self._show_merged_view, prepare=False, stage='decode:' + stage)
+
+        if self.batch_fetch:
+            paths = ['datahub.' + node_id for node_id in nodes]
+            self._pollers = [LatestPoller(self.socketio_client, 'datahub.batch', self._on_receive_batch,
+                                          max_in_flight=self.max_in_flight, data=batch_request(paths))]
+        else:
+            self._pollers = [LatestPoller(self.socketio_client, 'datahub.' + node_id.lower(), self._on_receive_paired_view(idx),
+                                          max_in_flight=self.max_in_flight)
+                             for idx, node_id in enumerate(nodes)]
+        return Clock.schedule_interval(self._poll_paired_views, self.frame_interval)
+
+    def _stop_paired_views(self):
+        for poller in self._pollers:
+            poller.reset()
+
+    def _poll_paired_views(self, dt):
+        for poller in self._pollers:
+            poller.poll()
+
+    def _on_receive_paired_view(self, idx):
+        @mainthread
+        def handle_paired_view(message):
+            self._handle_paired_view(idx, message)
+
+        return handle_paired_view
+
+    @mainthread
+    def _on_receive_batch(self, message):
+        # 沒有回傳的節點略過，等下一次
+        frames = message.get('frames', {})
+        for idx, node_id in enumerate(self._paired_nodes):
+            frame = frames.get('datahub.' + node_id.lower())
+            if frame is not None:
+                self._handle_paired_view(idx, frame)
+
+    def _handle_paired_view(self, idx, message):
+        # 將影像顯示於畫面
+        npimg_id = ['left_camera', 'right_camera'][idx]
+        self.ids[npimg_id].sio_image = message['image']
+        frames = self._pairer.add(idx, message)
+
+        if self._on_paired_view(idx, message) is False:
+            return
+
+        # 當 Homography 準備好的時候，把同一時間點的左右影像合併
+        if self._ready_to_merge_view and frames is not None:
+            # 在背景解碼，完成後於主執行緒合併
+            self._merge_decoder.submit([frame['image'] for frame in frames])
+
+    def _on_paired_view(self, idx, message):
+        pass
@@ -1,5 +1,4 @@
 import numpy as np
-import cv2
 
 from kivy.clock import Clock
 from kivy.properties import OptionProperty, NumericProperty
@@ -68,6 +67,7 @@ class PixelMappingScreen(GuideScreen):
 
 
     def generate_test_pattern(self):
+        import cv2
         # 在等同螢幕解析度的影像上畫出一些直線
         # 並以顏色區分長度
         w, h = self.windowsize
@@ -169,6 +169,7 @@ class PixelMappingScreen(GuideScreen):
 
 
     def _test_pixelmap(self):
+        import cv2
         # 取出四角，算出 homography
         w, h = self.windowsize
         grid = self._grideditor._mapping_grid
@@ -5,9 +5,13 @@ from kivy.clock import Clock, mainthread
 from kivyguidescreen import GuideScreen, GuideScreenVariable
 from kivyguidescreen.widgets.grideditor import Grid
 
-import cv2
 import numpy as np
 from kivyguidescreen.utils.armath import PerspectiveTransform
+from kivyguidescreen.utils.siosource import LatestPoller
+
+
+def _grid_coords(griddata):
+    return Grid(**griddata).coords()
 
 
 class VerifyArucoScreen(GuideScreen):
@@ -21,6 +25,8 @@ class VerifyArucoScreen(GuideScreen):
 
     paused = BooleanProperty(False)
 
+    max_in_flight = NumericProperty(1)
+
     def on_enter(self):
         # 建立桌面座標到像素的轉換
         table_points_pixel = self.table_points_pixel.read().coords
@@ -31,6 +37,7 @@ class VerifyArucoScreen(GuideScreen):
         self._lens_center_xyz = self.lens_center_xyz.read()
 
         # 固定索取 aruco 數據
+        self._poller = LatestPoller(self.socketio_client, self.tracker2d_source.lower(), self._on_receive_aruco, max_in_flight=self.max_in_flight)
         self._routine = Clock.schedule_interval(self._retrieve_aruco, 1/30)
 
 
@@ -50,13 +57,14 @@ class VerifyArucoScreen(GuideScreen):
         if self._routine:
             self._routine.cancel()
             self._routine = None
+            self._poller.reset()
 
 
     def _retrieve_aruco(self, dt):
         if self.paused:
             return
 
-        self.socketio_client.emit(event=self.tracker2d_source.lower(), data='', namespace=None, callback=self._on_receive_aruco)
+        self._poller.poll()
 
     def on_paused(self, caller, value):
         if not self.paused:
@@ -88,7 +96,7 @@ class VerifyArucoScreen(GuideScreen):
 
         # 畫出參考點
         canvas.add(Color(1, 1, 0))
-        p1, p2, p4, p3 = Grid(**self.table_points_mm.read()).coords()
+        p1, p2, p4, p3 = self.table_points_mm.derive(_grid_coords)
         draw_line(xy_points = [p1, p2, p3, p4], z=0, close=True)
 
         # 畫出校正器外框
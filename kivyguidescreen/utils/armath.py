@@ -1,13 +1,14 @@
-import cv2
 import numpy as np
 from numpy.linalg import norm
-from scipy.optimize import fsolve
+
+# cv2 與 scipy 載入很慢，等到真正用到時才在函數內 import
 
 
 
 class PerspectiveTransform():
 
     def __init__(self, matrix=None, point_pairs=None, src_points=None, dst_points=None):
+        import cv2
         vars = [matrix is None, point_pairs is None, src_points is None]
         assert vars.count(True) == len(vars) - 1, '三種定義方式只能使用其中之一'
 
@@ -24,7 +25,7 @@ class PerspectiveTransform():
 
 
     def apply(self, xy):
-        
+        import cv2
         pts = np.float32(xy).reshape(1, -1, 2)
         transform = np.float32(self._matrix)
 
@@ -36,6 +37,7 @@ class PerspectiveTransform():
 
 
 def find_homography(srcPoints, dstPoints):
+    import cv2
     mat, mask = cv2.findHomography(
         srcPoints = np.array(srcPoints),
         dstPoints = np.array(dstPoints),
@@ -109,6 +111,9 @@ def solve_projector_heading(\
         沿用名稱規範投影機投在特殊平面上的位置為 vP
     '''
     
+    import cv2
+    from scipy.optimize import fsolve
+
     # 投影機鏡心座標
     P = np.array(lens_center_xyz)
 
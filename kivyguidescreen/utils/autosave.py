@@ -0,0 +1,239 @@
+import os
+import json
+import uuid
+import threading
+from time import time
+
+import numpy as np
+
+from .denumpy import denumpy, referenced_digests, NdarrayStore
+
+
+# snapshot 與日誌的第一行都記下同一個 generation，不相符的日誌屬於更舊的 snapshot
+GENERATION_KEY = '_journal_generation'
+
+
+class SettingsJournal:
+
+    """
+    autosave 用的 append-only 日誌
+
+    完整的 settings 存在 snapshot 檔 (即原本的 autosave json)
+    之後每次 autosave 只把有變動的變數以一行 JSON 附加到 <snapshot>.journal
+    讀取時先載入 snapshot 再依序重播日誌，日誌過長時由 manager 重寫 snapshot 將其壓實
+    numpy 陣列存在設定檔旁的 NdarrayStore
+
+    換掉 snapshot 之後才刪除舊日誌，兩者之間中斷時留下的舊日誌以 generation 辨識並忽略
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.journal_filename = filename + '.journal'
+        self.basedir = os.path.dirname(filename)
+        self.store = NdarrayStore.for_settings_file(filename)
+        self._length = None
+        self._generation = None
+
+    @property
+    def length(self):
+        # 日誌中的紀錄筆數 (不含 generation 那一行)，第一次讀取時才去數既有檔案的行數
+        if self._length is None:
+            self._length = 0
+            if os.path.isfile(self.journal_filename):
+                with open(self.journal_filename) as journal:
+                    self._length = sum(1 for line in journal if line.strip() and GENERATION_KEY not in line[:30])
+        return self._length
+
+    def append(self, changes):
+        # 只序列化這次變動的變數，成本與變動量成正比
+        line = json.dumps(denumpy(changes, store=self.store, basedir=self.basedir))
+        if self._generation is None and os.path.isfile(self.filename):
+            with open(self.filename) as snapshot:
+                self._generation = json.load(snapshot).get(GENERATION_KEY)
+        with open(self.journal_filename, 'a') as journal:
+            if journal.tell() == 0 and self._generation is not None:
+                journal.write(json.dumps({GENERATION_KEY: self._generation}) + '\n')
+            journal.write(line + '\n')
+        self._length = self.length + 1
+
+    def write_snapshot(self, settings):
+        serializable = denumpy(settings, store=self.store, basedir=self.basedir)
+        generation = uuid.uuid4().hex
+
+        # 先寫到暫存檔再一次換掉，中途失敗也不會留下壞掉的 snapshot
+        tempname = self.filename + '.bak'
+        try:
+            with open(tempname, 'w') as tempfile:
+                json.dump(dict(serializable, **{GENERATION_KEY: generation}), tempfile, indent=4)
+            os.replace(tempname, self.filename)
+        except:
+            if os.path.isfile(tempname):
+                os.remove(tempname)
+            raise
+
+        # snapshot 已包含所有變動，並清掉沒有被引用的陣列
+        self._generation = generation
+        self.clear()
+        self.store.collect(referenced_digests(serializable))
+
+    def clear(self):
+        # snapshot 已包含所有變動，舊的日誌可以丟掉了
+        if os.path.isfile(self.journal_filename):
+            os.remove(self.journal_filename)
+        self._length = 0
+
+    def read(self):
+        with open(self.filename) as snapshot:
+            settings = json.load(snapshot)
+        generation = settings.pop(GENERATION_KEY, None)
+
+        if not os.path.isfile(self.journal_filename):
+            return settings
+
+        with open(self.journal_filename) as journal:
+            first = True
+            for line in journal:
+                if not line.strip():
+                    continue
+                try:
+                    changes = json.loads(line)
+                except ValueError:
+                    # 最後一行可能在寫入途中被中斷，之後的紀錄都不可信
+                    break
+
+                # 第一行的 generation 與 snapshot 不同時，整份日誌都屬於更舊的 snapshot
+                if first:
+                    first = False
+                    if changes.get(GENERATION_KEY) != generation:
+                        break
+                    if GENERATION_KEY in changes:
+                        continue
+                settings.update(changes)
+
+        return settings
+
+
+def snapshot_containers(obj, changed=()):
+    # 複製 dict 與 list 的結構，葉節點直接共用，成本與變數數量成正比
+    # changed 中的頂層變數剛被寫入，背景寫入前仍可能被原地修改，連同其中的 numpy 陣列一起複製
+    # 其餘變數的陣列視為不變 (寫入一律經過 update_settings)，lazy 的陣列以 dict.items 取值，維持不載入
+    return {k: _copy_containers(v, k in changed) for k, v in dict.items(obj)}
+
+
+def _copy_containers(obj, copy_arrays):
+    if copy_arrays and isinstance(obj, np.ndarray):
+        return np.array(obj)
+    if isinstance(obj, dict):
+        return {k: _copy_containers(v, copy_arrays) for k, v in dict.items(obj)}
+    if isinstance(obj, (list, tuple)):
+        return [_copy_containers(e, copy_arrays) for e in obj]
+    return obj
+
+
+class AutosaveWriter:
+
+    """
+    在背景執行緒寫入 SettingsJournal
+
+    request() 只登記這次的變動與 settings 的快照就立即返回
+    連續的 request 會在安靜 delay 秒之後合併成一次寫入
+    寫入失敗時呼叫 on_error(exception)，呼叫發生在背景執行緒
+    """
+
+    def __init__(self, journal, delay=0.5, compact_every=50, on_error=None):
+        self.journal = journal
+        self.delay = delay
+        self.compact_every = compact_every
+        self.on_error = on_error
+
+        # 任何對 journal 檔案的讀寫都要持有 io_lock
+        self.io_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._changes = {}
+        self._snapshot = None
+        self._last_request = 0
+        self._writing = False
+        self._synced = False
+        self._epoch = 0
+        self._thread = None
+
+    def request(self, changes, snapshot):
+        with self._cond:
+            self._changes.update(changes)
+            self._snapshot = snapshot
+            self._last_request = time()
+            self._cond.notify_all()
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='autosave', daemon=True)
+            self._thread.start()
+
+    def invalidate(self):
+        # settings 整個被換掉時呼叫，丟掉排隊中的寫入，下一次寫入改為完整的 snapshot
+        # 正在進行的寫入完成後也不會把狀態標回 synced
+        with self._cond:
+            self._changes = {}
+            self._snapshot = None
+            self._epoch += 1
+            self._synced = False
+            self._cond.notify_all()
+
+    def mark_synced(self):
+        with self._cond:
+            self._changes = {}
+            self._snapshot = None
+        self._synced = True
+
+    def flush(self, timeout=None):
+        # 等候排隊中的寫入完成，關閉視窗前呼叫
+        deadline = None if timeout is None else time() + timeout
+        with self._cond:
+            self._last_request = 0
+            self._cond.notify_all()
+            while self._snapshot is not None or self._writing:
+                remaining = None if deadline is None else deadline - time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._snapshot is None:
+                    self._cond.wait()
+
+                # 等到一段時間沒有新的 request 才寫，合併連續的 autosave
+                while True:
+                    remaining = self._last_request + self.delay - time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                changes, snapshot = self._changes, self._snapshot
+                self._changes, self._snapshot = {}, None
+                self._writing = True
+                epoch = self._epoch
+
+            try:
+                with self.io_lock:
+                    self._write(changes, snapshot)
+            except Exception as e:
+                self._synced = False
+                if self.on_error is not None:
+                    self.on_error(e)
+            finally:
+                with self._cond:
+                    if self._epoch != epoch:
+                        self._synced = False
+                    self._writing = False
+                    self._cond.notify_all()
+
+    def _write(self, changes, snapshot):
+        journal = self.journal
+        if not self._synced or journal.length >= self.compact_every:
+            # 壓實: 重寫完整的 snapshot 並清空日誌
+            journal.write_snapshot(snapshot)
+            self._synced = True
+        else:
+            journal.append(changes)
@@ -0,0 +1,133 @@
+"""
+單檔的 session bundle
+
+這是一個未壓縮的 zip (副檔名 .npz，np.load 也能直接打開裡面的陣列)
+    settings.json       denumpy 過的 settings，陣列以 <digest>.npy 的成員名稱引用
+    <digest>.npy        每個陣列存一份，資料起點對齊 64 bytes
+
+讀取時直接以 np.memmap 對應到 zip 內的資料區，不用解壓也不用逐一開檔
+"""
+
+import os
+import io
+import json
+import struct
+import zipfile
+
+import numpy as np
+
+from .denumpy import denumpy, NdarrayStore
+
+
+SETTINGS_MEMBER = 'settings.json'
+ALIGNMENT = 64
+
+# zip local file header 的固定長度以及用來補齊對齊的 extra field id (與 zipalign 相同)
+_LOCAL_HEADER_SIZE = 30
+_PADDING_EXTRA_ID = 0xD935
+
+
+class _BundleCollector:
+
+    # 給 denumpy 使用的 store，只蒐集陣列不寫檔
+
+    def __init__(self):
+        self.arrays = {}
+
+    def put(self, arr):
+        digest = NdarrayStore.digest(arr)
+        self.arrays[digest] = arr
+        return digest
+
+    def has(self, digest):
+        return digest in self.arrays
+
+    def relpath(self, digest, start):
+        return digest + '.npy'
+
+
+def _write_array(zf, name, arr):
+    arr = np.ascontiguousarray(arr)
+    if arr.dtype.hasobject:
+        raise ValueError('object arrays cannot be stored in a session bundle: ' + name)
+
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, np.lib.format.header_data_from_array_1_0(arr))
+    header = header.getvalue()
+
+    zinfo = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+    zinfo.compress_type = zipfile.ZIP_STORED
+    zinfo.file_size = len(header) + arr.nbytes
+
+    # 計算 local header 的長度，用 extra field 補齊讓資料起點對齊
+    zip64 = zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+    header_size = _LOCAL_HEADER_SIZE + len(name.encode('utf-8')) + (20 if zip64 else 0) + 4
+    padding = -(zf.fp.tell() + header_size) % ALIGNMENT
+    zinfo.extra = struct.pack('<HH', _PADDING_EXTRA_ID, padding) + b'\0' * padding
+
+    with zf.open(zinfo, 'w', force_zip64=zip64) as f:
+        f.write(header)
+        if arr.nbytes:
+            f.write(memoryview(arr.reshape(-1)).cast('B'))
+
+
+def save_bundle(filename, settings):
+    collector = _BundleCollector()
+    serializable = denumpy(settings, store=collector)
+
+    tempname = filename + '.bak'
+    try:
+        with zipfile.ZipFile(tempname, 'w', zipfile.ZIP_STORED) as zf:
+            zf.writestr(SETTINGS_MEMBER, json.dumps(serializable, indent=4))
+            for digest, arr in collector.arrays.items():
+                _write_array(zf, digest + '.npy', arr)
+        os.replace(tempname, filename)
+    except:
+        if os.path.isfile(tempname):
+            os.remove(tempname)
+        raise
+
+
+def _member_array(filename, zf, fp, name, mmap):
+    zinfo = zf.getinfo(name)
+    if not mmap or zinfo.compress_type != zipfile.ZIP_STORED or zinfo.file_size < ALIGNMENT * 16:
+        # 小陣列直接讀出來比較划算
+        with zf.open(name) as f:
+            return np.lib.format.read_array(f)
+
+    # 跳過 local header 找到 .npy 的起點
+    fp.seek(zinfo.header_offset)
+    local_header = fp.read(_LOCAL_HEADER_SIZE)
+    name_len, extra_len = struct.unpack('<HH', local_header[26:30])
+    fp.seek(zinfo.header_offset + _LOCAL_HEADER_SIZE + name_len + extra_len)
+
+    version = np.lib.format.read_magic(fp)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fp)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(fp)
+
+    return np.memmap(filename, dtype=dtype, mode='c', offset=fp.tell(), shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+def load_bundle(filename, mmap=True):
+    # mmap 時回傳 copy-on-write 的陣列，修改只留在記憶體，不會改到 bundle 檔
+
+    with zipfile.ZipFile(filename) as zf, open(filename, 'rb') as fp:
+        serializable = json.loads(zf.read(SETTINGS_MEMBER).decode('utf-8'))
+        loaded = {}
+
+        def restore(obj):
+            if isinstance(obj, list):
+                return [restore(e) for e in obj]
+            if isinstance(obj, dict):
+                if 'isnumpy' in obj:
+                    name = obj['path']
+                    if name not in loaded:
+                        loaded[name] = _member_array(filename, zf, fp, name, mmap)
+                    return loaded[name]
+                return {k: restore(v) for k, v in obj.items()}
+            return obj
+
+        return restore(serializable)
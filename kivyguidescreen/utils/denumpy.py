@@ -1,35 +1,167 @@
+import os
+import hashlib
+
 import numpy as np
 
 
-def renumpy(obj):
+class NdarrayStore:
+
+    """
+    以內容雜湊命名的 .npy 存放區，放在設定檔旁邊的 <設定檔名>_arrays 資料夾
+
+    相同內容的陣列只會寫入一次，不同 dict 內同名的變數也不會再互相覆蓋
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    @classmethod
+    def for_settings_file(cls, filename):
+        return cls(os.path.splitext(filename)[0] + '_arrays')
+
+    @staticmethod
+    def digest(arr):
+        arr = np.ascontiguousarray(arr)
+        h = hashlib.sha1()
+        h.update(arr.dtype.str.encode())
+        h.update(str(arr.shape).encode())
+        h.update(arr.data)
+        return h.hexdigest()
+
+    def put(self, arr):
+        digest = self.digest(arr)
+        path = os.path.join(self.root, digest + '.npy')
+
+        # 已經存在的內容不用重寫
+        if not os.path.isfile(path):
+            os.makedirs(self.root, exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, arr)
+            os.replace(path + '.tmp', path)
+
+        return digest
+
+    def has(self, digest):
+        return os.path.isfile(os.path.join(self.root, digest + '.npy'))
+
+    def relpath(self, digest, start):
+        return os.path.relpath(os.path.join(self.root, digest + '.npy'), start or os.curdir)
+
+    def collect(self, referenced):
+        # 刪除不再被任何設定引用的陣列
+        if not os.path.isdir(self.root):
+            return
+        for name in os.listdir(self.root):
+            digest, ext = os.path.splitext(name)
+            if ext in ['.npy', '.tmp'] and digest not in referenced:
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except OSError:
+                    # windows 上仍被 mmap 開著的檔案刪不掉，留待下次
+                    pass
+
+
+class LazyNdarray:
+
+    """
+    尚未載入的陣列，第一次 load() 時才以 mmap_mode='c' 開啟
+
+    copy-on-write 的 mmap 可以直接修改，改動只留在記憶體，不會寫回存放區內的檔案
+    """
+
+    def __init__(self, path, ref):
+        self.path = path
+        self.ref = ref
+        self._array = None
 
+    def load(self):
+        if self._array is None:
+            self._array = np.load(self.path, mmap_mode='c')
+        return self._array
+
+
+def realize(obj):
+    # 把結構中的 LazyNdarray 換成真正的陣列，沒有 LazyNdarray 時回傳原物件
+
+    if isinstance(obj, LazyNdarray):
+        return obj.load()
+
+    if isinstance(obj, (list, dict)):
+        items = list(obj.items()) if isinstance(obj, dict) else list(enumerate(obj))
+        realized = [(k, realize(v)) for k, v in items]
+        if all(new is old for (k, new), (k, old) in zip(realized, items)):
+            return obj
+        if isinstance(obj, dict):
+            return type(obj)(realized)
+        return [v for k, v in realized]
+
+    return obj
+
+
+def referenced_digests(obj):
+    # 列出 denumpy 過的結構中引用到的所有陣列雜湊
+    digests = set()
     if isinstance(obj, list):
-        return [renumpy(e) for e in obj]
+        for e in obj:
+            digests |= referenced_digests(e)
+    elif isinstance(obj, dict):
+        if 'isnumpy' in obj:
+            if 'digest' in obj:
+                digests.add(obj['digest'])
+        else:
+            for v in obj.values():
+                digests |= referenced_digests(v)
+    return digests
+
+
+def renumpy(obj, basedir='', lazy=False):
+    # lazy 時陣列先以 LazyNdarray 代替，等到 realize 時才 mmap 開啟
+
+    if isinstance(obj, list):
+        return [renumpy(e, basedir, lazy) for e in obj]
 
     if isinstance(obj, dict):
         if 'isnumpy' in obj:
             # 這個 dict 是 numpy 要組回來
-            return np.load(obj['path'])
+            path = obj['path']
+            if 'digest' in obj:
+                # 存放區內的路徑是相對於設定檔所在的資料夾
+                path = os.path.join(basedir, path)
+            if lazy:
+                return LazyNdarray(path, obj)
+            return np.load(path)
         else:
-            return {k:renumpy(v) for k, v in obj.items()}
+            return {k:renumpy(v, basedir, lazy) for k, v in obj.items()}
 
     return obj
 
 
-def denumpy(obj, var_key=None):
+def denumpy(obj, var_key=None, store=None, basedir=''):
     # 這個函數會深入 dict 與 list 形成的結構
     # 然後把 numpy 都另存成檔案，再留下檔名
     # 讓 output 物件變得 JSON serializable
+    # 有給 store 時改存進以內容雜湊命名的存放區
+
+    if isinstance(obj, LazyNdarray):
+        # 還沒載入的陣列若已在存放區內就直接沿用，不必讀出內容
+        if store is not None and 'digest' in obj.ref and store.has(obj.ref['digest']):
+            digest = obj.ref['digest']
+            return dict(isnumpy=True, path=store.relpath(digest, basedir), digest=digest)
+        obj = obj.load()
 
     if isinstance(obj, np.ndarray):
+        if store is not None:
+            digest = store.put(obj)
+            return dict(isnumpy=True, path=store.relpath(digest, basedir), digest=digest)
         assert var_key is not None
         np.save(var_key, obj)
         return dict(isnumpy=True, path=var_key+'.npy')
 
     if isinstance(obj, list):
-        return [denumpy(e) for e in obj]
+        return [denumpy(e, store=store, basedir=basedir) for e in obj]
 
     if isinstance(obj, dict):
-        return {k:denumpy(v, k) for k, v in obj.items()}
+        # 以 dict.items 取值，讀取時會自動載入的 dict (例如 manager.settings) 也保持 lazy
+        return {k:denumpy(v, k, store, basedir) for k, v in dict.items(obj)}
 
-    return obj
\ No newline at end of file
+    return obj
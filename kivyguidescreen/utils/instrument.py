@@ -0,0 +1,108 @@
+"""
+影像管線各階段的耗時統計
+
+    request:<事件>    送出請求到收到回應
+    decode            背景執行緒解碼與轉換
+    decode:<畫面>     合併畫面前在背景解碼左右影像，與 warp 分開計時
+    blit              主執行緒把影像上傳到 texture
+    warp:<畫面>       warpPerspective
+
+統計以畫面為單位 (scope 由 GuideScreenManager 在切換畫面時設定)
+每個階段保留最近 window 筆，另外累計被丟掉的影像數
+drops 只算已經收到或解碼完成、卻被更新的影像取代而沒有顯示的影像，略過的輪詢不算
+"""
+
+import os
+import csv
+import threading
+from time import perf_counter, strftime
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+PERCENTILES = [50, 90, 99]
+
+
+class StageStats:
+
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.drops = 0
+
+    def summary(self):
+        # 以毫秒為單位
+        samples = np.array(self.samples) * 1000
+        if len(samples) == 0:
+            return [None] * len(PERCENTILES) + [None]
+        return np.percentile(samples, PERCENTILES).round(2).tolist() + [round(float(samples.max()), 2)]
+
+
+class PipelineStats:
+
+    def __init__(self, window=300):
+        self.window = window
+        self.scope = ''
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def _stage(self, stage):
+        key = (self.scope, stage)
+        stats = self._stages.get(key)
+        if stats is None:
+            with self._lock:
+                stats = self._stages.setdefault(key, StageStats(self.window))
+        return stats
+
+    def record(self, stage, seconds):
+        # 可以在任何執行緒呼叫
+        stats = self._stage(stage)
+        stats.samples.append(seconds)
+        stats.count += 1
+
+    def count_drop(self, stage, n=1):
+        self._stage(stage).drops += n
+
+    @contextmanager
+    def measure(self, stage):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, perf_counter() - start)
+
+    def rows(self, scope=None):
+        # [scope, stage, count, drops, p50, p90, p99, max]
+        with self._lock:
+            items = sorted(self._stages.items())
+        return [[s, stage, stats.count, stats.drops] + stats.summary()
+                for (s, stage), stats in items if scope is None or s == scope]
+
+    def format(self, scope=None):
+        scope = self.scope if scope is None else scope
+        header = '{:<28}{:>8}{:>8}' + '{:>9}' * (len(PERCENTILES) + 1)
+        lines = [scope, header.format('stage', 'count', 'drops', *['p%d' % q for q in PERCENTILES], 'max')]
+        for row in self.rows(scope):
+            values = ['-' if v is None else '%.1f' % v for v in row[4:]]
+            lines.append(header.format(row[1][:27], row[2], row[3], *values))
+        return '\n'.join(lines)
+
+    def export_csv(self, filename):
+        # 附加到檔案後面，每次匯出的每一列都記下時間，方便事後比較
+        is_new = not os.path.isfile(filename)
+        now = strftime('%Y-%m-%d %H:%M:%S')
+        with open(filename, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if is_new:
+                writer.writerow(['time', 'screen', 'stage', 'count', 'drops'] + ['p%d_ms' % q for q in PERCENTILES] + ['max_ms'])
+            for row in self.rows():
+                writer.writerow([now] + row)
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+
+
+pipeline_stats = PipelineStats()
@@ -0,0 +1,331 @@
+"""
+批次、差異式的 jsonhub 儲存
+
+'jsonhub.batch_save' 的 data 為 dict(docs=[...])，較大時改送 dict(encoding='zlib', payload=<壓縮過的 json>)
+docs 中的每一筆是下列其中一種
+    dict(id=..., base=<版本>, set={有變動的 key: 值}, unset=[被刪掉的 key])
+    dict(id=..., full={完整內容})
+回應為 dict(results={id: dict(ok=True, version=<新版本>)})
+ok 為 False 表示 server 上的版本已經不是 base，client 會改送完整內容再試一次
+
+不認得 'jsonhub.batch_save' 的舊版 datahub 不會回應 (或回應不是上述格式)
+此時改以 'jsonhub.save' 逐一送出完整內容，version 為 None
+
+JsonHubCache 在這之上加了本機快取與 write-behind 佇列，讀取不必等網路，server 不在時儲存也不會遺失
+"""
+
+import os
+import json
+import zlib
+import threading
+import weakref
+from time import time
+from functools import partial
+from urllib.parse import quote
+
+
+def diff_document(old, new):
+    changed = {k: v for k, v in new.items() if k not in old or old[k] != v}
+    removed = [k for k in old if k not in new]
+    return changed, removed
+
+
+def _plain(doc):
+    # 與 server 上的內容相同的純 json 結構，tuple 會變成 list，之後比較差異才不會誤判
+    return json.loads(json.dumps(doc))
+
+
+class JsonHubSync:
+
+    """
+    記住每個 id 最後一次被 server 確認的版本與內容，save_many 時只送出變動的 key
+
+    同一條 socketio 連線共用一個，請用 jsonhub_sync(sio) 取得
+    callback 在 socketio 的執行緒上被呼叫
+    """
+
+    def __init__(self, sio, compress_threshold=1024):
+        self.compress_threshold = compress_threshold
+        self._sio = sio
+        self._lock = threading.Lock()
+        self._acked = {}
+        self._batch_supported = True
+
+    def save_many(self, documents, callback=None, compress=True):
+        # documents 是 {id: dict}，回傳給 callback 的是 {id: dict(ok, version)}
+        documents = {id: _plain(dict(doc, id=id)) for id, doc in documents.items()}
+        results = {}
+        ops = []
+
+        if not self._batch_supported:
+            self._save_each(documents, results, callback)
+            return
+
+        with self._lock:
+            for id, doc in documents.items():
+                if id not in self._acked:
+                    ops.append(dict(id=id, full=doc))
+                    continue
+                version, acked = self._acked[id]
+                changed, removed = diff_document(acked, doc)
+                if changed or removed:
+                    ops.append(dict(id=id, base=version, set=changed, unset=removed))
+                else:
+                    # 與 server 上的內容相同，不必送出
+                    results[id] = dict(ok=True, version=version)
+
+        if not ops:
+            if callback is not None:
+                callback(results)
+            return
+
+        self._send(ops, documents, results, callback, compress, retry=True)
+
+    def forget(self, id=None):
+        # 下次改送完整內容，例如 server 的資料被清掉時
+        with self._lock:
+            if id is None:
+                self._acked = {}
+            else:
+                self._acked.pop(id, None)
+
+    def _send(self, ops, documents, results, callback, compress, retry):
+        data = dict(docs=ops)
+        if compress:
+            raw = json.dumps(data).encode('utf-8')
+            if len(raw) >= self.compress_threshold:
+                data = dict(encoding='zlib', payload=zlib.compress(raw))
+
+        on_ack = partial(self._on_ack, documents, results, callback, compress, retry)
+        on_timeout = partial(self._save_each, documents, results, callback, detect=True)
+        self._sio.emit(event='jsonhub.batch_save', data=data, namespace=None, callback=on_ack, on_timeout=on_timeout)
+
+    def _on_ack(self, documents, results, callback, compress, retry, response=None):
+        if not isinstance(response, dict) or not isinstance(response.get('results'), dict):
+            # server 有回應但不認得這個事件
+            self._batch_supported = False
+            self._save_each(documents, results, callback)
+            return
+
+        conflicts = []
+        with self._lock:
+            for id, result in response['results'].items():
+                if id not in documents:
+                    continue
+                if result.get('ok'):
+                    self._acked[id] = (result['version'], documents[id])
+                    results[id] = result
+                else:
+                    self._acked.pop(id, None)
+                    conflicts.append(dict(id=id, full=documents[id]))
+                    results[id] = result
+
+        if conflicts and retry:
+            # 有人在這之間改過 server 上的內容，改送完整內容 (只重試一次)
+            self._send(conflicts, documents, results, callback, compress, retry=False)
+        elif callback is not None:
+            callback(results)
+
+    def _save_each(self, documents, results, callback, detect=False):
+        # 以舊版的 'jsonhub.save' 逐一送出還沒有結果的文件
+        # detect 為 True 時是 batch_save 沒有回應，若逐一送出有成功就當作 server 不支援 batch_save
+        ids = [id for id in documents if id not in results or not results[id].get('ok')]
+        remaining = set(ids)
+        if not ids:
+            if callback is not None:
+                callback(results)
+            return
+
+        def done(id, ok):
+            with self._lock:
+                if id not in remaining:
+                    return
+                self._acked.pop(id, None)
+                results[id] = dict(ok=bool(ok), version=None)
+                remaining.discard(id)
+                finished = not remaining
+                if detect and ok:
+                    self._batch_supported = False
+            if finished and callback is not None:
+                callback(results)
+
+        # 舊版的 ack 不一定帶內容，有回應就算成功，只有逾時才算失敗
+        for id in ids:
+            self._sio.emit(event='jsonhub.save', data=documents[id], namespace=None,
+                           callback=lambda *args, id=id: done(id, True),
+                           on_timeout=lambda id=id: done(id, False))
+
+
+_syncs = weakref.WeakKeyDictionary()
+
+def jsonhub_sync(sio):
+    if sio not in _syncs:
+        _syncs[sio] = JsonHubSync(sio)
+    return _syncs[sio]
+
+
+def _write_json(filename, obj):
+    # 先寫暫存檔再換掉，中途失敗也不會留下壞掉的檔案
+    tempname = filename + '.bak'
+    with open(tempname, 'w') as f:
+        json.dump(obj, f, indent=4)
+    os.replace(tempname, filename)
+
+
+def _read_json(filename, default=None):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+class JsonHubCache:
+
+    """
+    jsonhub 的本機快取與 write-behind 佇列
+
+        <directory>/docs/<id>.json      每個 id 最後已知的內容
+        <directory>/pending.json        還沒被 server 確認的儲存 {id: 內容}
+
+    load 先以快取的內容呼叫 callback，再向 server 重新確認，內容不同時以新內容再呼叫一次
+    沒有快取時只以 server 的回應呼叫一次 (沒有這個 id 時為 None)
+    save_many 先寫進快取與佇列才送出，server 確認之後才從佇列移除
+    沒有送達的儲存在 retry_interval 秒後重送，之後每次失敗間隔加倍到 retry_max 為止
+    重新連線時與程式重開後也會接著送
+    """
+
+    def __init__(self, sio, directory, retry_interval=5, retry_max=300, flush_timeout=30):
+        self.directory = directory
+        self.retry_interval = retry_interval
+        self.retry_max = retry_max
+        self.flush_timeout = flush_timeout
+        self._sio = sio
+        self._sync = jsonhub_sync(sio)
+        self._lock = threading.Lock()
+        self._flushing_since = None
+        self._waiting = []
+        self._retry_delay = retry_interval
+        self._retry_event = None
+
+        os.makedirs(os.path.join(directory, 'docs'), exist_ok=True)
+        self._pending_filename = os.path.join(directory, 'pending.json')
+        self._pending = _read_json(self._pending_filename, {})
+
+        sio.on('connect', self.flush)
+        if self._pending:
+            self.flush()
+
+    def _doc_filename(self, id):
+        return os.path.join(self.directory, 'docs', quote(id, safe='') + '.json')
+
+    def cached(self, id):
+        with self._lock:
+            if id in self._pending:
+                return self._pending[id]
+        return _read_json(self._doc_filename(id))
+
+    def load(self, id, callback):
+        doc = self.cached(id)
+        if doc is not None:
+            callback(doc)
+
+        def on_loaded(fresh=None):
+            if fresh is None:
+                if doc is None:
+                    callback(None)
+                return
+            fresh = _plain(fresh)
+            with self._lock:
+                # 本機還有沒送出的修改時，以本機為準
+                if id in self._pending or fresh == doc:
+                    return
+                _write_json(self._doc_filename(id), fresh)
+            callback(fresh)
+
+        self._sio.emit(event='jsonhub.load', data=id, namespace=None, callback=on_loaded)
+
+    def save_many(self, documents, callback=None, compress=True):
+        with self._lock:
+            for id, doc in documents.items():
+                doc = _plain(dict(doc, id=id))
+                self._pending[id] = doc
+                _write_json(self._doc_filename(id), doc)
+            _write_json(self._pending_filename, self._pending)
+
+        self.flush(callback=callback, compress=compress)
+
+    @property
+    def pending(self):
+        with self._lock:
+            return list(self._pending)
+
+    def flush(self, *args, callback=None, compress=True):
+        # 可以直接當作 Clock 或 socketio 事件的 callback
+        with self._lock:
+            if callback is not None:
+                self._waiting.append(callback)
+            if not self._pending:
+                callbacks, self._waiting = self._waiting, []
+                sending = None
+            elif self._flushing_since is not None and time() - self._flushing_since < self.flush_timeout:
+                # 上一次送出還沒有回應，等它回來再送
+                return
+            else:
+                callbacks, self._waiting = self._waiting, []
+                sending = dict(self._pending)
+                self._flushing_since = time()
+
+        if sending is None:
+            for cb in callbacks:
+                cb({})
+            return
+
+        self._sync.save_many(sending, callback=partial(self._on_flushed, sending, callbacks), compress=compress)
+
+    def _on_flushed(self, sent, callbacks, results):
+        with self._lock:
+            for id, result in results.items():
+                # 送出之後又被改過的內容要留在佇列裡
+                if result.get('ok') and self._pending.get(id) == sent[id]:
+                    del self._pending[id]
+            _write_json(self._pending_filename, self._pending)
+            self._flushing_since = None
+            more = any(self._pending.get(id) != sent.get(id) for id in self._pending)
+            failed = bool(self._pending) and not more
+            if not failed:
+                self._retry_delay = self.retry_interval
+            if not more:
+                # 送出期間才登記的 callback 等的也是這一次的結果 (例如連按兩次 space 送出相同內容)
+                callbacks, self._waiting = callbacks + self._waiting, []
+
+        for cb in callbacks:
+            cb(results)
+
+        if more:
+            self.flush()
+        elif failed:
+            self._schedule_retry()
+
+    def _schedule_retry(self):
+        # 失敗一次間隔加倍，避免 server 不在時一直重送
+        from kivy.clock import Clock
+
+        if self._retry_event is not None:
+            self._retry_event.cancel()
+        self._retry_event = Clock.schedule_once(self.flush, self._retry_delay)
+        self._retry_delay = min(self._retry_delay * 2, self.retry_max)
+
+    def close(self):
+        if self._retry_event is not None:
+            self._retry_event.cancel()
+        self._sio.off('connect', self.flush)
+
+
+_caches = weakref.WeakKeyDictionary()
+
+def jsonhub_cache(sio, root):
+    # 每條連線一個快取，放在 root 底下以位址命名的資料夾
+    if sio not in _caches:
+        _caches[sio] = JsonHubCache(sio, os.path.join(root, quote(sio.address, safe='')))
+    return _caches[sio]
@@ -0,0 +1,180 @@
+"""
+共用的 socketio 連線
+
+所有連線都是 socketio.AsyncClient，跑在同一條背景執行緒的 asyncio event loop 上
+畫面拿到的是 SioConnection，介面與 socketio.Client 的 emit / on / disconnect 相同
+但所有呼叫都立即返回，連線、重連與等待回應都不會卡住 kivy 的主執行緒
+"""
+
+import asyncio
+import threading
+
+from kivy.logger import Logger
+
+
+class SioConnection:
+
+    """
+    一個位址的連線，由同一位址的所有畫面共用
+
+    第一次連線失敗會以指數退避重試，連上之後斷線則交給 AsyncClient 內建的重連
+    尚未連上時送出的 emit 會等到連上為止，超過 timeout 就放棄並呼叫 on_timeout (沒有時記在 log)
+    等待回應超過 timeout 也一樣，呼叫端可以在 on_timeout 中重送
+    callback 與 on_timeout 在 event loop 的執行緒上被呼叫，需要時請自行加上 mainthread
+    """
+
+    def __init__(self, pool, address):
+        import socketio
+
+        self.address = address
+        self._pool = pool
+        self._connected = None
+        self._closing = False
+        self._listeners = {'connect': [], 'disconnect': []}
+
+        self._client = socketio.AsyncClient(
+            reconnection=True,
+            reconnection_delay=pool.reconnect_delay,
+            reconnection_delay_max=pool.reconnect_delay_max)
+        self._client.on('connect', self._on_connect)
+        self._client.on('disconnect', self._on_disconnect)
+
+    @property
+    def connected(self):
+        return self._client.connected
+
+    def emit(self, event, data=None, namespace=None, callback=None, timeout=None, on_timeout=None):
+        if timeout is None:
+            timeout = self._pool.request_timeout
+        self._pool.submit(self._emit(event, data, namespace, callback, timeout, on_timeout))
+
+    def on(self, event, handler):
+        # 每個事件都可以有多個 listener，共用連線的畫面才不會互相蓋掉
+        if event not in self._listeners:
+            self._listeners[event] = []
+            self._client.on(event, lambda *args, event=event: self._dispatch(event, *args))
+        if handler not in self._listeners[event]:
+            self._listeners[event].append(handler)
+
+    def off(self, event, handler):
+        if event in self._listeners:
+            if handler in self._listeners[event]:
+                self._listeners[event].remove(handler)
+
+    def listeners(self, event):
+        return list(self._listeners.get(event, []))
+
+    def _dispatch(self, event, *args):
+        for listener in list(self._listeners[event]):
+            listener(*args)
+
+    def disconnect(self):
+        self._closing = True
+        self._pool.submit(self._disconnect())
+
+    async def _start(self):
+        # asyncio.Event 要在 event loop 的執行緒上建立
+        pool = self._pool
+        self._connected = asyncio.Event()
+
+        delay = pool.reconnect_delay
+        while not self._closing:
+            try:
+                await self._client.connect(self.address, wait_timeout=pool.request_timeout)
+                return
+            except Exception as e:
+                Logger.warning('SioConnection: cannot connect to {} ({!r}), retry in {}s'.format(self.address, e, delay))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, pool.reconnect_delay_max)
+
+    def _on_connect(self):
+        Logger.info('SioConnection: connected to ' + self.address)
+        self._connected.set()
+        for listener in list(self._listeners['connect']):
+            listener()
+
+    def _on_disconnect(self, *args):
+        Logger.warning('SioConnection: disconnected from ' + self.address)
+        self._connected.clear()
+        for listener in list(self._listeners['disconnect']):
+            listener()
+
+    async def _emit(self, event, data, namespace, callback, timeout, on_timeout):
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout)
+        except asyncio.TimeoutError:
+            Logger.warning('SioConnection: {} is not connected, dropped {}'.format(self.address, event))
+            if on_timeout is not None:
+                on_timeout()
+            return
+
+        if callback is None:
+            await self._client.emit(event, data, namespace=namespace)
+            return
+
+        ack = asyncio.get_running_loop().create_future()
+
+        def on_ack(*args):
+            if not ack.done():
+                ack.set_result(args)
+
+        await self._client.emit(event, data, namespace=namespace, callback=on_ack)
+        try:
+            args = await asyncio.wait_for(ack, timeout)
+        except asyncio.TimeoutError:
+            Logger.debug('SioConnection: no response to {} within {}s'.format(event, timeout))
+            if on_timeout is not None:
+                on_timeout()
+            return
+        callback(*args)
+
+    async def _disconnect(self):
+        await self._client.disconnect()
+
+
+class SocketIOPool:
+
+    """
+    管理背景的 event loop 以及每個位址一條的 SioConnection
+    """
+
+    def __init__(self, request_timeout=5, reconnect_delay=1, reconnect_delay_max=30):
+        self.request_timeout = request_timeout
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_delay_max = reconnect_delay_max
+
+        self._connections = {}
+        self._loop = None
+        self._thread = None
+
+    def connection(self, address):
+        if address not in self._connections:
+            self._connections[address] = conn = SioConnection(self, address)
+            self.submit(conn._start())
+        return self._connections[address]
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def close(self, timeout=2):
+        if self._loop is None:
+            return
+        for conn in self._connections.values():
+            conn._closing = True
+        futures = [self.submit(conn._disconnect()) for conn in self._connections.values()]
+        for future in futures:
+            try:
+                future.result(timeout)
+            except Exception:
+                pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+        self._connections = {}
+        self._loop = self._thread = None
+
+    def _ensure_loop(self):
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name='socketio', daemon=True)
+            self._thread.start()
+        return self._loop
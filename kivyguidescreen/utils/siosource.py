@@ -0,0 +1,292 @@
+import threading
+from time import time
+from functools import partial
+from collections import deque
+
+from kivy.clock import Clock
+
+from .instrument import pipeline_stats
+from .siotypes import colorfmt_request
+
+
+class NodeConnector:
+
+    """
+    向 datahub 的節點送出一次請求確認它已經上線，畫面進入時用來顯示連線狀態
+
+    datahub 還沒連上或沒有回應 (逾時) 時每 retry_interval 秒重試一次
+    第一次收到回應時在主執行緒以回應呼叫 callback，之後的回應與 cancel() 之後的回應都會被忽略
+    """
+
+    def __init__(self, sio, event, callback, retry_interval=1, data=''):
+        self.event = event
+        self.retry_interval = retry_interval
+        self.data = data
+
+        self._sio = sio
+        self._callback = callback
+        self._active = False
+        self._event = None
+
+    @property
+    def active(self):
+        return self._active
+
+    def start(self, delay=0):
+        self._active = True
+        self._event = Clock.schedule_once(self._emit, delay)
+
+    def cancel(self):
+        # 離開畫面時呼叫
+        self._active = False
+        if self._event is not None:
+            self._event.cancel()
+            self._event = None
+
+    def _emit(self, *args):
+        if self._active:
+            self._sio.emit(event=self.event, data=self.data, namespace=None, callback=self._on_ack, on_timeout=self._on_timeout)
+
+    def _on_timeout(self):
+        # 在 socketio 的執行緒上執行，Clock.schedule_once 可以跨執行緒呼叫
+        if self._active:
+            self._event = Clock.schedule_once(self._emit, self.retry_interval)
+
+    def _on_ack(self, *args):
+        Clock.schedule_once(lambda dt: self._deliver(args))
+
+    def _deliver(self, args):
+        if not self._active:
+            return
+        self._active = False
+        self._callback(*args)
+
+
+def connect_node(sio, event, callback, retry_interval=1, delay=0):
+    # 建立並開始一個 NodeConnector，離開畫面時呼叫它的 cancel()
+    connector = NodeConnector(sio, event, callback, retry_interval)
+    connector.start(delay)
+    return connector
+
+
+class FrameSubscription:
+
+    """
+    向 datahub 訂閱一個節點，由 server 主動推送每一張新影像，取代固定頻率的輪詢
+
+    協定:
+        client -> 'subscribe'     data=dict(path=<節點>, max_fps=<上限或 None>, **request)
+        server -> <節點>          data=message，內容與輪詢時 callback 收到的相同
+        client -> 'unsubscribe'   data=dict(path=<節點>)
+
+    只保留最新的一張影像，在主執行緒的下一個 frame 交給 callback
+    主執行緒還沒處理完之前又收到的舊影像直接丟掉，並記在 dropped
+    訂閱只在連上時送出，斷線重連之後 server 已忘記訂閱，會自動重新訂閱
+    """
+
+    def __init__(self, sio, path, callback, max_fps=None, request=None):
+        # request 是 siotypes.image_request 產生的影像格式參數
+        self.path = path
+        self.max_fps = max_fps
+        self.request = request or {}
+        self.dropped = 0
+
+        self._sio = sio
+        self._callback = callback
+        self._lock = threading.Lock()
+        self._latest = None
+        self._active = False
+        self._trigger = Clock.create_trigger(self._deliver)
+
+    @property
+    def active(self):
+        return self._active
+
+    def start(self):
+        self._active = True
+        self._sio.on(self.path, self._on_push)
+        self._sio.on('connect', self._subscribe)
+
+        # 還沒連上時交給 connect 事件送出，避免連上之後送出兩次
+        if self._sio.connected:
+            self._subscribe()
+
+    def stop(self):
+        if not self._active:
+            return
+        self._active = False
+        self._sio.off('connect', self._subscribe)
+        self._sio.off(self.path, self._on_push)
+        self._trigger.cancel()
+        with self._lock:
+            self._latest = None
+
+        # 同一條連線上還有其他畫面訂閱這個節點時不取消訂閱
+        if not self._sio.listeners(self.path):
+            self._sio.emit(event='unsubscribe', data=dict(path=self.path), namespace=None)
+
+    def update_request(self, request):
+        # 改變影像格式，已經訂閱時重新訂閱一次
+        self.request = request or {}
+        if self._active and self._sio.connected:
+            self._subscribe()
+
+    def negotiate_colorfmt(self, sioimage):
+        # 收到的影像回報了 colorfmt 時改訂閱保留原本通道順序的影像，見 siotypes.colorfmt_request
+        request = colorfmt_request(self.request, sioimage)
+        if request is not None:
+            self.update_request(request)
+
+    def _subscribe(self):
+        self._sio.emit(event='subscribe', data=dict(self.request, path=self.path, max_fps=self.max_fps), namespace=None)
+
+    def _on_push(self, message):
+        # 在 socketio 的執行緒上執行
+        if not self._active:
+            return
+        with self._lock:
+            if self._latest is not None:
+                self.dropped += 1
+                pipeline_stats.count_drop('push:' + self.path)
+            self._latest = message
+        self._trigger()
+
+    def _deliver(self, dt):
+        with self._lock:
+            message, self._latest = self._latest, None
+        if message is not None and self._active:
+            self._callback(message)
+
+
+def batch_request(paths, request=None):
+    """
+    一次向 datahub 索取多個節點的 data，搭配 'datahub.batch' 事件使用
+
+    回應為 dict(frames={<節點>: message})，每個 message 都帶有擷取時的 timestamp
+    request 是 siotypes.image_request 產生的影像格式參數，套用到所有節點
+    """
+    return dict(request or {}, paths=[path.lower() for path in paths])
+
+
+class LatestPoller:
+
+    """
+    以輪詢方式向 datahub 索取資料，同時最多只有 max_in_flight 個請求在等待回應
+
+    每個請求帶一個遞增的序號，比已交出去的回應還舊的回應直接丟掉
+    datahub 比輪詢頻率慢時，多出來的 poll() 會被略過而不是在 server 端排隊
+    預設只允許一個，延遲超過輪詢間隔時可以調高，讓多個請求重疊以維持畫面更新率
+    使用它的畫面都有同名的 max_in_flight 屬性，建立 LatestPoller 時傳入
+    超過 timeout 秒沒有回應的請求視為遺失，讓出位置給新的請求
+    callback 會在 socketio 的執行緒上被呼叫，需要時請自行加上 mainthread
+    """
+
+    def __init__(self, sio, event, callback, max_in_flight=1, timeout=1., data=''):
+        self.event = event
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.data = data
+        self.skipped = 0
+        self.stale = 0
+
+        self._sio = sio
+        self._callback = callback
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._delivered_seq = 0
+        self._in_flight = {}
+
+    def poll(self, *args):
+        # 可以直接當作 Clock.schedule_interval 的 callback
+        # 略過的輪詢與逾時的請求都沒有產生影像，不算進 pipeline_stats 的 drops
+        now = time()
+        with self._lock:
+            for seq, sent_at in list(self._in_flight.items()):
+                if now - sent_at > self.timeout:
+                    del self._in_flight[seq]
+
+            if len(self._in_flight) >= self.max_in_flight:
+                self.skipped += 1
+                return False
+
+            self._seq += 1
+            seq = self._seq
+            self._in_flight[seq] = now
+
+        self._sio.emit(event=self.event, data=self.data, namespace=None, callback=partial(self._on_response, seq))
+        return True
+
+    def negotiate_colorfmt(self, sioimage):
+        # 收到的影像回報了 colorfmt 時之後的請求改要保留原本通道順序的影像，見 siotypes.colorfmt_request
+        request = colorfmt_request(self.data, sioimage)
+        if request is not None:
+            self.data = request
+
+    def reset(self):
+        # 離開畫面時呼叫，之後才到的回應都會被丟掉
+        with self._lock:
+            self._in_flight.clear()
+            self._delivered_seq = self._seq
+
+    def _on_response(self, seq, message):
+        stage = 'request:' + self.event
+        with self._lock:
+            sent_at = self._in_flight.pop(seq, None)
+            if sent_at is not None:
+                pipeline_stats.record(stage, time() - sent_at)
+            if seq <= self._delivered_seq:
+                self.stale += 1
+                pipeline_stats.count_drop(stage)
+                return
+            self._delivered_seq = seq
+        self._callback(message)
+
+
+class FramePairer:
+
+    """
+    把多個來源的訊息依 timestamp 配成一組，合併畫面時才不會混到不同時間點的影像
+
+    每個來源保留最近 depth 筆，所有來源的 timestamp 都落在 tolerance 秒內才算配對成功
+    配對過的訊息與更舊的訊息會被丟掉
+    datahub 沒有給 timestamp 時無從比對，每個來源都有新訊息時就取各自最新的一筆配成一組
+    """
+
+    def __init__(self, num_sources, tolerance=1/60, depth=4):
+        self.tolerance = tolerance
+        self._queues = [deque(maxlen=depth) for _ in range(num_sources)]
+
+    def add(self, idx, message):
+        # 配對成功時回傳依來源排列的訊息 list，否則回傳 None
+        t = message.get('timestamp')
+        self._queues[idx].append((t, message))
+
+        if t is None or any(queue and queue[-1][0] is None for queue in self._queues):
+            if not all(self._queues):
+                return None
+            group = [queue[-1][1] for queue in self._queues]
+            self.clear()
+            return group
+
+        group = []
+        for j, queue in enumerate(self._queues):
+            if j == idx:
+                group.append((t, message))
+                continue
+            if not queue:
+                return None
+            nearest = min(queue, key=lambda entry: abs(entry[0] - t))
+            if abs(nearest[0] - t) > self.tolerance:
+                return None
+            group.append(nearest)
+
+        # 丟掉已經配對過以及更舊的訊息
+        for queue, (used_t, _) in zip(self._queues, group):
+            while queue and queue[0][0] <= used_t:
+                queue.popleft()
+
+        return [message for _, message in group]
+
+    def clear(self):
+        for queue in self._queues:
+            queue.clear()
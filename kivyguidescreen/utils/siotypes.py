@@ -0,0 +1,293 @@
+"""
+datahub 透過 socketio 傳來的資料型別
+
+sio image 是形如 dict(shape=..., array=<bytes>, dtype=...) 的 dict
+另外可以有 encoding (raw / jpeg / png / lz4) 以及 server 實際套用的 scale 與 roi
+jpeg 與 png 的 array 是壓縮後的檔案內容，shape 與 dtype 由檔頭決定
+lz4 的 array 是以 lz4.frame 壓縮的原始資料
+colorfmt 是彩色影像的通道順序 (例如來自 opencv 的 bgr)，沒有時視為 rgb / rgba
+"""
+
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from kivy.clock import Clock
+from kivy.logger import Logger
+
+from .instrument import pipeline_stats
+
+
+def sioimage_to_numpy(sioimage):
+    # 舊版的 sio image 沒有 dtype，由 shape 與資料長度推算
+    shape = sioimage['shape']
+    array = sioimage['array']
+
+    def find_dtype(shape, array):
+        if len(shape) == 3:
+            dtype = np.uint8
+        elif len(shape) == 2:
+            h, w = shape[0:2]
+            bytes_per_pixel = len(array) / (h * w)
+
+            if bytes_per_pixel == 1:
+                dtype = np.uint8
+            elif bytes_per_pixel == 2:
+                dtype = np.uint16
+
+        return dtype
+
+    dtype = find_dtype(shape, array)
+    return np.frombuffer(array, dtype=dtype).reshape(*shape)
+
+
+IMAGE_ENCODINGS = ['raw', 'jpeg', 'png', 'lz4']
+
+# NumpyImage 不必在 cpu 上轉換就能顯示的通道順序，bgr 與 bgra 在 shader 裡對調
+DISPLAY_COLORFMTS = ['luminance', 'rgb', 'rgba', 'bgr', 'bgra']
+
+
+def image_request(encoding='raw', scale=1, roi=None, colorfmts=None):
+    """
+    索取影像時放在 data 的參數，全部為預設值時回傳 '' 以相容舊版的 datahub
+
+    scale 是縮小倍率，0.5 即一半的解析度
+    roi 是 [x, y, w, h]，以原始解析度的像素為單位，先裁切再縮小
+    colorfmts 是 client 可以直接顯示的通道順序，影像原本的順序在其中時 server 不必轉換
+    server 在 sio image 的 colorfmt 回報實際的順序
+    舊版的 datahub 不認得 colorfmts，請先不帶，等 server 回報過 colorfmt 再以 colorfmt_request 加上
+    """
+    assert encoding in IMAGE_ENCODINGS, encoding
+    request = {}
+    if encoding != 'raw':
+        request['encoding'] = encoding
+    if scale != 1:
+        request['scale'] = scale
+    if roi is not None:
+        request['roi'] = [int(n) for n in roi]
+    if colorfmts is not None:
+        request['colorfmts'] = list(colorfmts)
+    return request or ''
+
+
+def colorfmt_request(request, sioimage):
+    # 收到的 sio image 有 colorfmt 表示 datahub 認得 colorfmts
+    # 此時回傳加上 colorfmts 的 request，不需要 (或已經加過) 時回傳 None
+    if 'colorfmt' not in sioimage or (request and 'colorfmts' in request):
+        return None
+    return dict(request or {}, colorfmts=DISPLAY_COLORFMTS)
+
+
+def decode_sio_image(sioimage):
+    encoding = sioimage.get('encoding', 'raw')
+
+    if encoding in ['jpeg', 'png']:
+        # 通道順序與 server 編碼前相同，不做 BGR 轉換
+        import cv2
+        data = np.frombuffer(sioimage['array'], dtype=np.uint8)
+        img = cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+        if img is None:
+            raise ValueError('cannot decode {} image'.format(encoding))
+        return img
+
+    if encoding == 'lz4':
+        import lz4.frame
+        array = lz4.frame.decompress(sioimage['array'])
+        return np.frombuffer(array, dtype=sioimage['dtype']).reshape(*sioimage['shape'])
+
+    if 'dtype' not in sioimage:
+        return sioimage_to_numpy(sioimage)
+    shape, array, dtype = [sioimage[it] for it in ['shape', 'array', 'dtype']]
+    return np.frombuffer(array, dtype=dtype).reshape(*shape)
+
+
+# array 是原始影像，buffer 是可以直接 blit_buffer 的連續 ubyte 資料 (memoryview 或 sio image 原本的 bytes)
+# colorfmt 是 buffer 的通道順序，可能是 bgr / bgra，上傳時由 NumpyImage 對調
+# scale 是影像相對於原始解析度的倍率
+# staged 是從 StagingBuffers 借來的陣列，blit 完要還回去，沒有借時為 None
+DisplayFrame = namedtuple('DisplayFrame', ['array', 'buffer', 'size', 'colorfmt', 'scale', 'staged'], defaults=[None])
+
+
+class StagingBuffers:
+
+    """
+    轉換影像用的暫存陣列，依 shape 與 dtype 重複使用，避免每張影像都重新配置記憶體
+
+    acquire 借出的陣列用完要 release，可以在不同執行緒借還
+    """
+
+    def __init__(self, keep=2):
+        self.keep = keep
+        self._free = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, shape, dtype):
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                return free.pop()
+        return np.empty(shape, dtype=dtype)
+
+    def release(self, array):
+        if array is None:
+            return
+        key = (array.shape, array.dtype.str)
+        with self._lock:
+            free = self._free.setdefault(key, [])
+            if len(free) < self.keep:
+                free.append(array)
+
+
+_CHANNELS = {'luminance': 1, 'rgb': 3, 'bgr': 3, 'rgba': 4, 'bgra': 4}
+
+
+def prepare_frame(img, scale=1, staging=None, raw_depth=False, colorfmt='auto'):
+    display = img
+    staged = None
+    raw_depth = raw_depth and img.dtype == np.uint16
+
+    # raw_depth 時 16bit 影像原封不動上傳成 luminance_alpha，由 NumpyImage 的 shader 組回 16bit
+    if raw_depth:
+        if display.dtype.byteorder == '>':
+            display = display.astype('<u2')
+
+    # 16bit 的影像通常來自深度相機，而且它只會用到 12 bit
+    # 此時捨棄後 4bit 轉換成 8bit 灰階影像再顯示 (clip 到 4000 之後右移 4 bit 與除以 16 取整相同)
+    elif display.dtype == np.uint16:
+        if staging is None:
+            display = np.uint8(display.clip(1, 4000) >> 4)
+        else:
+            clipped = staging.acquire(img.shape, np.uint16)
+            np.clip(img, 1, 4000, out=clipped)
+            np.right_shift(clipped, 4, out=clipped)
+            display = staged = staging.acquire(img.shape, np.uint8)
+            np.copyto(display, clipped, casting='unsafe')
+            staging.release(clipped)
+
+    # 不連續的資料 (裁切、翻轉後的 view) 複製一次，連續的直接使用
+    # kivy 的 blit_buffer 以非 const 的 char[:] 接收 memoryview，唯讀的陣列 (例如 mmap) 要複製一次
+    # 但 bytes 本身可以直接交給 blit_buffer，datahub 的 raw 影像 (np.frombuffer) 不必複製
+    source = display.base
+    while isinstance(source, np.ndarray):
+        source = source.base
+    buffer = None
+    if display.flags.c_contiguous and isinstance(source, bytes) and len(source) == display.nbytes:
+        buffer = source
+    elif not display.flags.c_contiguous or not display.flags.writeable:
+        if staging is None:
+            display = np.array(display, order='C')
+        else:
+            staged = staging.acquire(display.shape, display.dtype)
+            np.copyto(staged, display)
+            display = staged
+
+    # 訂出顏色種類，指定的 colorfmt 與通道數不合時 (例如深度影像) 依通道數決定
+    shape = display.shape
+    h, w = shape[:2]
+    num_channels = 1 if len(shape) == 2 else shape[2]
+    if raw_depth:
+        colorfmt = 'luminance_alpha'
+    elif _CHANNELS.get(colorfmt) != num_channels:
+        colorfmt = {1:'luminance', 3:'rgb', 4:'rgba'}[num_channels]
+
+    if buffer is None:
+        buffer = memoryview(display).cast('B')
+    return DisplayFrame(img, buffer, (w, h), colorfmt, scale, staged)
+
+
+def prepare_sio_frame(sioimage, staging=None, raw_depth=False, colorfmt='auto'):
+    # colorfmt 為 auto 時使用 server 回報的通道順序
+    if colorfmt == 'auto':
+        colorfmt = sioimage.get('colorfmt', 'auto')
+    return prepare_frame(decode_sio_image(sioimage), sioimage.get('scale', 1), staging, raw_depth, colorfmt)
+
+
+_decode_pool = None
+
+def decode_pool():
+    # 所有 FrameDecoder 共用的執行緒，第一次用到時才建立
+    global _decode_pool
+    if _decode_pool is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _decode_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='frame-decoder')
+    return _decode_pool
+
+
+class FrameDecoder:
+
+    """
+    在背景執行緒把 sio image 解碼成 DisplayFrame，再於主執行緒交給 callback
+
+    每個 decoder 同時只有一張影像在解碼，解碼期間送來的影像只保留最新的一張
+    主執行緒只需要做 blit_buffer，callback 返回之後 frame 的 buffer 會被重複使用
+
+    prepare 為 False 時只解碼，callback 收到的是 numpy array
+    submit 一組 sio image (list) 時 callback 收到依序排列的 list，例如 FramePairer 配好的左右影像
+    stage 是 pipeline_stats 中的階段名稱
+    """
+
+    def __init__(self, callback, raw_depth=False, colorfmt='auto', prepare=True, stage='decode'):
+        self._callback = callback
+        self.prepare = prepare
+        self.stage = stage
+        self.raw_depth = raw_depth
+        self.colorfmt = colorfmt
+        self._staging = StagingBuffers()
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._shown_seq = 0
+        self._busy = False
+        self._pending = None
+
+    def submit(self, sioimage):
+        with self._lock:
+            self._seq += 1
+            if self._busy:
+                if self._pending is not None:
+                    pipeline_stats.count_drop(self.stage)
+                self._pending = (self._seq, sioimage)
+                return
+            self._busy = True
+            seq = self._seq
+        decode_pool().submit(self._run, seq, sioimage)
+
+    def _run(self, seq, sioimage):
+        while True:
+            try:
+                with pipeline_stats.measure(self.stage):
+                    frame = self._decode(sioimage)
+            except Exception:
+                Logger.exception('FrameDecoder: failed to decode frame')
+            else:
+                Clock.schedule_once(lambda dt, seq=seq, frame=frame: self._deliver(seq, frame))
+
+            with self._lock:
+                if self._pending is None:
+                    self._busy = False
+                    return
+                (seq, sioimage), self._pending = self._pending, None
+
+    def _decode(self, sioimage):
+        if isinstance(sioimage, (list, tuple)):
+            return [self._decode(it) for it in sioimage]
+        if not self.prepare:
+            return decode_sio_image(sioimage)
+        return prepare_sio_frame(sioimage, self._staging, self.raw_depth, self.colorfmt)
+
+    def _release(self, frame):
+        if isinstance(frame, list):
+            for it in frame:
+                self._release(it)
+        elif isinstance(frame, DisplayFrame):
+            self._staging.release(frame.staged)
+
+    def _deliver(self, seq, frame):
+        # 在主執行緒執行，比已顯示的還舊的影像直接丟掉
+        if seq > self._shown_seq:
+            self._shown_seq = seq
+            self._callback(frame)
+        else:
+            pipeline_stats.count_drop(self.stage)
+        self._release(frame)
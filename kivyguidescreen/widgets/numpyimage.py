@@ -1,12 +1,52 @@
 from kivy.uix.image import Image
-from kivy.uix.widget import Widget
+from kivy.graphics import RenderContext, Color, Rectangle
 from kivy.graphics.texture import Texture
-import cv2
-import numpy as np
 
-from kivy.properties import NumericProperty, ObjectProperty, StringProperty, BooleanProperty
-from kivy.uix.relativelayout import RelativeLayout
+from kivy.properties import NumericProperty, ObjectProperty, StringProperty, BooleanProperty, OptionProperty, ListProperty
 
+from kivyguidescreen.utils.siotypes import prepare_frame, prepare_sio_frame, FrameDecoder, StagingBuffers, DISPLAY_COLORFMTS
+from kivyguidescreen.utils.instrument import pipeline_stats
+
+
+# kivy 預設的 fragment shader，另外可以對調 r 與 b 以直接顯示 bgr / bgra 影像
+plain_fs = '''
+$HEADER$
+uniform int swap_rb;
+
+void main (void) {
+    vec4 color = texture2D(texture0, tex_coord0);
+    if (swap_rb == 1)
+        color = color.bgra;
+    gl_FragColor = frag_color * color;
+}
+'''
+
+# bgr 與 bgra 以 rgb 與 rgba 上傳，在 shader 裡對調，不必在 cpu 上轉換
+UPLOAD_COLORFMTS = {'bgr': 'rgb', 'bgra': 'rgba'}
+
+# 16bit 深度影像以 luminance_alpha 上傳，低位元組在 luminance、高位元組在 alpha
+# 組回原始數值之後依 depth_clip 拉到 0 ~ 1 再套上 colormap
+DEPTH_COLORMAPS = ['gray', 'jet', 'hsv']
+
+depth_fs = '''
+$HEADER$
+uniform vec2 depth_clip;
+uniform int depth_colormap;
+
+void main (void) {
+    vec4 texel = texture2D(texture0, tex_coord0);
+    float depth = (texel.r + texel.a * 256.0) * 255.0;
+    float v = clamp((depth - depth_clip.x) / (depth_clip.y - depth_clip.x), 0.0, 1.0);
+
+    vec3 color = vec3(v);
+    if (depth_colormap == 1)
+        color = clamp(vec3(1.5) - abs(4.0 * v - vec3(3.0, 2.0, 1.0)), 0.0, 1.0);
+    else if (depth_colormap == 2)
+        color = clamp(abs(mod(v * 6.0 + vec3(0.0, 4.0, 2.0), 6.0) - 3.0) - 1.0, 0.0, 1.0);
+
+    gl_FragColor = frag_color * vec4(color, 1.0);
+}
+'''
 
 
 class NumpyImage(Image):
@@ -17,12 +57,51 @@ class NumpyImage(Image):
     vertical_flip = BooleanProperty(False)
     horizontal_flip = BooleanProperty(False)
 
+    # 把 sio_image 的解碼與轉換交給背景執行緒，主執行緒只做 blit
+    decode_in_background = BooleanProperty(True)
+
+    # 影像相對於原始解析度的倍率，由 sio_image 的 scale 決定
+    # 要以原始解析度的像素為座標時，把 size 設為 texture_size / image_scale
+    image_scale = NumericProperty(1.)
+
+    # 16bit 影像的顯示方式
+    # cpu: 在 cpu 上 clip 到 1 ~ 4000 再轉成 8bit 灰階
+    # shader: 原封不動上傳，clip 與 colormap 在 fragment shader 裡做，可以即時調整
+    depth_mode = OptionProperty('cpu', options=['cpu', 'shader'])
+    depth_clip = ListProperty([1, 4000])
+    depth_colormap = OptionProperty('gray', options=DEPTH_COLORMAPS)
+
+    # 影像的通道順序，auto 時依 sio image 回報的順序或通道數決定，例如 opencv 的影像請設為 bgr
+    colorfmt = OptionProperty('auto', options=['auto'] + DISPLAY_COLORFMTS)
+
+    # 目前顯示中的影像實際使用的通道順序
+    frame_colorfmt = StringProperty('')
+
     def __init__(self, numpy_image=None, sio_image=None, **kwargs):
+        # 只有影像本身畫在可以替換 shader 的 RenderContext 裡 (放在 canvas.before)
+        # NumpyImage 可能有子 widget (例如 GridEditor)，它們仍以預設的 shader 畫在 canvas 上
+        self._render_context = RenderContext(use_parent_projection=True, use_parent_modelview=True, use_parent_frag_modelview=True)
+        self._fs = plain_fs
+        self._render_context.shader.fs = plain_fs
+        with self._render_context:
+            self._image_color = Color(1, 1, 1, 1)
+            self._image_rect = Rectangle()
+
         super().__init__(**kwargs)
+        self.canvas.before.add(self._render_context)
+        self.bind(texture=self._update_image_rect, norm_image_size=self._update_image_rect,
+                  center=self._update_image_rect, color=self._update_image_rect)
+        self._update_image_rect()
+        self.on_depth_clip()
+        self.on_depth_colormap()
 
         self._texture = None
         self._resolution = None
         self._colorfmt = None
+        self._decoder = None
+        self._decoded_frame = None
+        self._source_colorfmt = 'auto'
+        self._staging = StagingBuffers()
 
         if numpy_image is not None:
             self.numpy_image = numpy_image
@@ -31,23 +110,57 @@ class NumpyImage(Image):
             self.sio_image = sio_image
 
 
+    def _update_image_rect(self, *args):
+        # 與 Image 預設的 kv 規則相同的位置與大小
+        w, h = self.norm_image_size
+        self._image_color.rgba = self.color
+        self._image_rect.texture = self.texture
+        self._image_rect.size = (w, h)
+        self._image_rect.pos = (self.center_x - w / 2., self.center_y - h / 2.)
+
+
     def on_numpy_image(self, *args):
         img = self.numpy_image
 
-        # 16bit 的影像通常來自深度相機，而且它只會用到 12 bit
-        # 此時捨棄後 4bit 轉換成 8bit 灰階影像再顯示
-        if img.dtype == np.uint16:
-            img = np.uint8(img.clip(1, 4000)/16.)
+        with pipeline_stats.measure('blit'):
+            # 由 FrameDecoder 送來的影像已經在背景轉換好了
+            frame = self._decoded_frame
+            self._decoded_frame = None
+            if frame is not None and frame.array is img:
+                self._blit_frame(frame)
+            else:
+                # 直接指定的 numpy_image 沒有 server 回報的通道順序
+                self._source_colorfmt = 'auto'
+                self._blit_array(img)
+
+
+    def _blit_array(self, img):
+        colorfmt = self._source_colorfmt if self.colorfmt == 'auto' else self.colorfmt
+        frame = prepare_frame(img, staging=self._staging, raw_depth=self.depth_mode == 'shader', colorfmt=colorfmt)
 
-        # 訂出顏色種類
-        shape = img.shape
-        h, w = shape[:2]
-        num_channels = 1 if len(shape) == 2 else shape[2]
-        colorfmt = {1:'luminance', 3:'rgb', 4:'rgba'}[num_channels]
+        # blit_buffer 會把資料複製到 gpu，之後 staging buffer 就可以還回去
+        self._blit_frame(frame)
+        self._staging.release(frame.staged)
+
+
+    def _blit_frame(self, frame):
+        w, h = frame.size
+        colorfmt = frame.colorfmt
+
+        # 16bit 影像的兩個位元組分開內插會得到錯的數值，所以不做內插
+        fs = depth_fs if colorfmt == 'luminance_alpha' else plain_fs
+        if self._fs != fs:
+            self._render_context.shader.fs = self._fs = fs
 
         # 初始化 texture
+        upload_colorfmt = UPLOAD_COLORFMTS.get(colorfmt, colorfmt)
         if self._resolution != (w, h) or self._colorfmt != colorfmt:
-            self._texture = Texture.create(size=(w, h), colorfmt=colorfmt, bufferfmt='ubyte')
+            self._texture = Texture.create(size=(w, h), colorfmt=upload_colorfmt, bufferfmt='ubyte')
+            self._render_context['swap_rb'] = int(colorfmt in UPLOAD_COLORFMTS)
+            self.frame_colorfmt = 'luminance' if colorfmt == 'luminance_alpha' else colorfmt
+            if colorfmt == 'luminance_alpha':
+                self._texture.min_filter = 'nearest'
+                self._texture.mag_filter = 'nearest'
             if self.vertical_flip:
                 self._texture.flip_vertical()
             if self.horizontal_flip:
@@ -56,15 +169,58 @@ class NumpyImage(Image):
             self._colorfmt = colorfmt
         
         # 將圖片填入 gpu texture
-        self._texture.blit_buffer(img.flatten(), colorfmt=colorfmt, bufferfmt='ubyte')
+        self._texture.blit_buffer(frame.buffer, colorfmt=upload_colorfmt, bufferfmt='ubyte')
 
         # 把影像交給 image
         self.texture = self._texture
-        self.canvas.ask_update()
+        self._render_context.ask_update()
 
 
     def on_sio_image(self, *args):
-        img = self.sio_image
-        shape, array, dtype = [img[it] for it in ['shape', 'array', 'dtype']]
-        self.numpy_image = npimage = np.frombuffer(array, dtype=dtype).reshape(*shape)
+        if not self.decode_in_background:
+            self._on_frame_decoded(prepare_sio_frame(self.sio_image, raw_depth=self.depth_mode == 'shader', colorfmt=self.colorfmt))
+            return
+
+        # 解碼與轉換在背景執行緒進行，numpy_image 會在下一個 frame 才更新
+        if self._decoder is None:
+            self._decoder = FrameDecoder(self._on_frame_decoded)
+        self._decoder.raw_depth = self.depth_mode == 'shader'
+        self._decoder.colorfmt = self.colorfmt
+        self._decoder.submit(self.sio_image)
+
+
+    def _on_frame_decoded(self, frame):
+        self._decoded_frame = frame
+        self._source_colorfmt = frame.colorfmt
+        self.image_scale = frame.scale
+        self.numpy_image = frame.array
+
+
+    def on_depth_mode(self, *args):
+        # 以新的方式重畫目前的影像
+        if self.numpy_image is not None:
+            self._blit_array(self.numpy_image)
+
+
+    def on_colorfmt(self, *args):
+        if self.numpy_image is not None:
+            self._blit_array(self.numpy_image)
+
+
+    def on_depth_clip(self, *args):
+        near, far = self.depth_clip
+        self._render_context['depth_clip'] = (float(near), float(max(far, near + 1)))
+
+
+    def on_depth_colormap(self, *args):
+        self._render_context['depth_colormap'] = DEPTH_COLORMAPS.index(self.depth_colormap)
+
+
+
+from kivy.lang import Builder
+Builder.load_string("""
+
+# 影像改由 canvas.before 中的 RenderContext 畫出，不套用 Image 預設的 canvas 規則
+<-NumpyImage>:
 
+""")